@@ -0,0 +1,157 @@
+"""
+Compares requests per second of one process serving the read endpoints, once through the WSGI application
+with --threads worker threads, as a threaded WSGI server runs it, and once through the ASGI variant with a pool of
+--threads threads and a task per concurrent client. The latencies of the ASGI run include the wait of the
+--concurrency clients for a thread. --db-latency-ms adds a wait to every statement, standing in for the network
+round trip to the database server which SQLite does not have.
+
+    python -m benchmarks.async_reads --threads 8 --concurrency 64 --seconds 10 --db-latency-ms 5
+"""
+import asyncio
+import os
+from argparse import ArgumentParser
+from tempfile import mkdtemp
+from threading import Event, Thread
+from time import perf_counter, sleep
+from sqlalchemy import event
+from server import db
+from server.asgi import AsyncApplication, call_wsgi, get_environ
+from benchmarks.dataset import DatasetGenerator, words
+from benchmarks.support import create_benchmark_app
+
+
+def get_requests(isbns: list[str]) -> list[tuple]:
+    """(method, path, query, body) cycled through by every client."""
+    requests = []
+    for number in range(len(words)):
+        requests += [
+            ('POST', '/search/', b'', f'{{"phrase": "{words[number]}", "columns": ["TITLE", "AUTHOR"], '
+                                      f'"group": "EVERYTHING", "offset": 0, "limit": 20}}'.encode('utf-8')),
+            ('GET', f"/api/book/{isbns[number * 7919 % len(isbns)]}", b'', b''),
+            ('GET', '/v1/statistics/books/popular/10', b'', b''),
+            ('GET', '/v1/statistics/loans/averageTimeInDays', b'', b''),
+            ('GET', '/api/library/loans/overdue', b'', b''),
+        ]
+    return requests
+
+
+def get_scope(method: str, path: str, query: bytes, cookie: str) -> dict:
+    return {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'root_path': '',
+        'query_string': query,
+        'headers': [(b'content-type', b'application/json'), (b'cookie', f"session={cookie}".encode('latin-1'))],
+    }
+
+
+def percentile(samples: list[float], share: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))] if len(ordered) > 0 else float('nan')
+
+
+def report(name: str, latencies: list[float], failed: int, seconds: float) -> None:
+    print(f"{name:6} {len(latencies) / seconds:9.1f} req/s  p50 {percentile(latencies, 0.5):8.2f}ms  "
+          f"p95 {percentile(latencies, 0.95):8.2f}ms  failed {failed}")
+
+
+def run_sync(app, requests: list[tuple], cookie: str, concurrency: int, seconds: float) -> None:
+    stopped = Event()
+    latencies = []
+    failed = [0]
+
+    def client(number: int):
+        while not stopped.is_set():
+            method, path, query, body = requests[number % len(requests)]
+            started = perf_counter()
+            status, _, _ = call_wsgi(app, get_environ(get_scope(method, path, query, cookie), body))
+            latencies.append((perf_counter() - started) * 1000)
+            failed[0] += status != 200
+            number += concurrency
+
+    threads = [Thread(target=client, args=(number,)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    stopped.wait(seconds)
+    stopped.set()
+    for thread in threads:
+        thread.join()
+    report('sync', latencies, failed[0], seconds)
+
+
+async def run_async(app: AsyncApplication, requests: list[tuple], cookie: str, concurrency: int,
+                    seconds: float) -> None:
+    latencies = []
+    failed = 0
+    deadline = perf_counter() + seconds
+
+    async def client(number: int):
+        nonlocal failed
+        while perf_counter() < deadline:
+            method, path, query, body = requests[number % len(requests)]
+            messages = [{'type': 'http.request', 'body': body}]
+            sent = []
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                sent.append(message)
+
+            started = perf_counter()
+            await app(get_scope(method, path, query, cookie), receive, send)
+            latencies.append((perf_counter() - started) * 1000)
+            failed += sent[0]['status'] != 200
+            number += concurrency
+
+    await asyncio.gather(*[client(number) for number in range(concurrency)])
+    await app.close()
+    report('asgi', latencies, failed, seconds)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--loans', type=int, default=100000)
+    parser.add_argument('--threads', type=int, default=8, help='Worker threads of the WSGI and ASGI applications.')
+    parser.add_argument('--concurrency', type=int, default=64, help='Concurrent clients of the ASGI application.')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--db-latency-ms', type=float, default=0)
+    parser.add_argument('--search-backend', default='procedure', choices=['procedure', 'index'])
+    args = parser.parse_args()
+
+    database = f"sqlite:///{os.path.join(mkdtemp(), 'reads.sqlite')}"
+    # without the search result cache, so searches reach the database on every request
+    app = create_benchmark_app(database, SEARCH_BACKEND=args.search_backend, BCRYPT_LOG_ROUNDS=4,
+                               PASSWORD_POOL_WORKERS=0, POPULAR_BOOKS_RECONCILE_SECONDS=0, SEARCH_CACHE_SIZE=0,
+                               ASYNC_WORKER_THREADS=args.threads)
+    with app.app_context():
+        DatasetGenerator(books=args.books, customers=args.customers, loans=args.loans,
+                         wishlist_items=args.customers).generate(db.session.connection())
+        db.session.commit()
+        isbns = [isbn for isbn, in db.session.execute('select isbn from book order by isbn')]
+    client = app.test_client()
+    client.post('/library/login', json={'email': 'librarian0@gtl.dk', 'password': 'password'})
+    cookie = next(cookie.value for cookie in client.cookie_jar if cookie.name == 'session')
+    async_app = AsyncApplication(app)
+    latency = args.db_latency_ms / 1000
+
+    if latency > 0:
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', lambda *arguments: sleep(latency))
+
+    requests = get_requests(isbns)
+    print(f"{args.threads} threads, {args.concurrency} concurrent clients, {args.seconds:.0f}s, "
+          f"database latency {args.db_latency_ms}ms")
+    for method, path, query, body in requests:
+        call_wsgi(app, get_environ(get_scope(method, path, query, cookie), body))
+    run_sync(app, requests, cookie, args.threads, args.seconds)
+    asyncio.run(run_async(async_app, requests, cookie, args.concurrency, args.seconds))
+
+
+if __name__ == '__main__':
+    main()
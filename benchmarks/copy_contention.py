@@ -0,0 +1,98 @@
+"""
+Lets many threads race for the last copies of one book through Book.take_copy and Book.return_copy, checks that
+no copy is ever oversold or returned twice and prints the throughput of the conditional updates.
+
+    python -m benchmarks.copy_contention --threads 32 --copies 5 --attempts 200
+"""
+import os
+from argparse import ArgumentParser
+from tempfile import mkdtemp
+from threading import Barrier, Lock, Thread
+from time import perf_counter
+from sqlalchemy.exc import OperationalError
+from server import db
+from server.models import Book
+from benchmarks.support import create_benchmark_app
+
+
+def run(app, threads: int, copies: int, attempts: int) -> None:
+    with app.app_context():
+        db.session.add(Book(isbn='rush', title='Course reserve', author='Author', subject_area='CS',
+                            total_copies=copies, available_copies=copies))
+        db.session.commit()
+
+    barrier = Barrier(threads)
+    lock = Lock()
+    results = {'taken': 0, 'sold_out': 0, 'returned': 0, 'retried': 0, 'held': 0, 'max_held': 0}
+
+    def count(key: str, times: int = 1, held: int = 0) -> None:
+        with lock:
+            results[key] += times
+            results['held'] += held
+            results['max_held'] = max(results['max_held'], results['held'])
+
+    def desk():
+        with app.app_context():
+            barrier.wait()
+            mine = 0
+            for attempt in range(attempts):
+                try:
+                    if attempt % 4 < 2:
+                        taken = Book.take_copy('rush')
+                        db.session.commit()
+                        if taken:
+                            mine += 1
+                            count('taken', held=1)
+                        else:
+                            count('sold_out')
+                    elif mine > 0:
+                        count('returned', held=-1)
+                        try:
+                            if not Book.return_copy('rush'):
+                                raise AssertionError('Copy returned while all copies were available!')
+                            db.session.commit()
+                            mine -= 1
+                        except OperationalError:
+                            count('returned', times=-1, held=1)
+                            raise
+                except OperationalError:
+                    db.session.rollback()
+                    count('retried')
+            db.session.remove()
+
+    workers = [Thread(target=desk) for _ in range(threads)]
+    started = perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = perf_counter() - started
+
+    with app.app_context():
+        available = db.session.query(Book).get('rush').available_copies
+    updates = results['taken'] + results['sold_out'] + results['returned']
+    print(f"{threads} threads x {attempts} attempts on {copies} copies: {updates / elapsed:8.1f} updates/s")
+    print(f"  taken {results['taken']}  sold out {results['sold_out']}  returned {results['returned']}  "
+          f"busy database {results['retried']}")
+    print(f"  most copies held at once {results['max_held']}, available at the end {available}, "
+          f"expected {copies - results['taken'] + results['returned']}")
+    if results['max_held'] > copies or available != copies - results['taken'] + results['returned']:
+        raise SystemExit(1)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--copies', type=int, default=5)
+    parser.add_argument('--attempts', type=int, default=200)
+    parser.add_argument('--database', default=None, help='SQLAlchemy database URI, a temporary SQLite file by default.')
+    args = parser.parse_args()
+
+    database = args.database or f"sqlite:///{os.path.join(mkdtemp(), 'contention.sqlite')}"
+    app = create_benchmark_app(database, SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 30}}
+                               if database.startswith('sqlite') else {})
+    run(app, args.threads, args.copies, args.attempts)
+
+
+if __name__ == '__main__':
+    main()
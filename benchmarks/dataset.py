@@ -0,0 +1,298 @@
+"""
+Generates a synthetic library at production scale for load testing: books with a skewed popularity, customers with
+cards and phone numbers, wishlists with pending reservations and years of loan history with realistic shares of
+open and overdue loans. Rows are built by the constructors of the models, so they pass the same validation as the
+application, and written with bulk inserts in a single transaction. The output only depends on the seed and on
+--today, every account has the password 'password'.
+
+    python -m benchmarks.dataset --database sqlite:////tmp/gtl.sqlite
+    python -m benchmarks.dataset --database sqlite:////tmp/gtl.sqlite --loans 5000000 --seed 3
+"""
+from argparse import ArgumentParser
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate
+from random import Random
+from time import perf_counter
+from uuid import UUID
+import bcrypt
+from sqlalchemy import create_engine, func, select
+from server.config import Config
+from server.models import Address, Base, Book, Campus, Card, Customer, CustomerWishlistItem, Librarian, Loan, \
+    PhoneNumber
+
+first_names = ['Anna', 'Peter', 'Maria', 'Lars', 'Sofie', 'Jens', 'Emma', 'Mikkel', 'Ida', 'Rasmus', 'Laura',
+               'Frederik', 'Julie', 'Mads', 'Freja', 'Oliver', 'Clara', 'Emil', 'Karen', 'Niels']
+last_names = ['Jensen', 'Nielsen', 'Hansen', 'Pedersen', 'Andersen', 'Christensen', 'Larsen', 'Sørensen',
+              'Rasmussen', 'Jørgensen', 'Petersen', 'Madsen', 'Kristensen', 'Olsen', 'Thomsen', 'Poulsen']
+cities = [('Aalborg', '9000'), ('Aarhus', '8000'), ('Copenhagen', '1050'), ('Odense', '5000'), ('Esbjerg', '6700')]
+streets = ['Algade', 'Boulevarden', 'Vesterbro', 'Nørregade', 'Havnegade', 'Skolevej', 'Parkvej', 'Kirkegade']
+subject_areas = ['Computer Science', 'Mathematics', 'Physics', 'History', 'Economics', 'Law', 'Medicine', 'Biology',
+                 'Philosophy', 'Literature', 'Engineering', 'Psychology']
+words = ['data', 'systems', 'history', 'theory', 'design', 'modern', 'applied', 'introduction', 'principles',
+         'analysis', 'networks', 'methods', 'structures', 'foundations', 'practice', 'advanced', 'European',
+         'quantum', 'social', 'digital', 'algorithms', 'economy', 'language', 'culture', 'energy', 'health']
+resource_types = ['BOOK', 'ARTICLE', 'JOURNAL', 'MAP']
+resource_type_weights = [80, 12, 6, 2]
+bcrypt_alphabet = './ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+
+
+def isbn13(number: int) -> str:
+    digits = f"978{number:09d}"
+    check = sum(int(digit) * (3 if index % 2 else 1) for index, digit in enumerate(digits))
+    return f"{digits}{(10 - check % 10) % 10}"
+
+
+def get_row(instance, **values) -> dict:
+    """The column values of a model instance created by its constructor, overridden by values."""
+    row = {column.key: getattr(instance, column.key) for column in instance.__table__.columns}
+    row.update(values)
+    return row
+
+
+def skewed_cum_weights(rng: Random, size: int, exponent: float) -> list[float]:
+    """Zipf-like cumulative weights over a random permutation of the indices, so the popular ones are scattered."""
+    ranks = list(range(1, size + 1))
+    rng.shuffle(ranks)
+    return list(accumulate(1 / rank ** exponent for rank in ranks))
+
+
+class DatasetGenerator:
+    """
+    Writes the dataset through a connection owning the transaction. Open loans and wishlists are generated before
+    the books and customers, so available copies and the borrowed and reserved counters are consistent with them.
+    Every table is generated by a random generator of its own, so changing one volume keeps the other tables.
+    """
+
+    def __init__(self, seed: int = 7, books: int = 200000, customers: int = 200000, loans: int = 1000000,
+                 wishlist_items: int = 300000, open_ratio: float = 0.05, overdue_ratio: float = 0.2,
+                 days: int = 5 * 365, campuses: int = 3, librarians: int = 30, today: date = None,
+                 grace_period_days: int = Config.LOAN_GRACE_PERIOD_DAYS, batch_size: int = 10000,
+                 password_rounds: int = 4):
+        self.seed = seed
+        self.books = books
+        self.customers = customers
+        self.loans = loans
+        self.wishlist_items = min(wishlist_items, books * customers)
+        self.open_ratio = open_ratio
+        self.overdue_ratio = overdue_ratio
+        self.days = days
+        self.campuses = campuses
+        self.librarians = librarians
+        self.now = datetime.combine(today or date.today(), time())
+        self.grace_period_days = grace_period_days
+        self.batch_size = batch_size
+        self.password_rounds = password_rounds
+
+    def _random(self, name: str) -> Random:
+        return Random(f"{self.seed}-{name}")
+
+    def _uuid(self, rng: Random) -> str:
+        return str(UUID(int=rng.getrandbits(128), version=4))
+
+    def _salt(self, rng: Random) -> bytes:
+        """A bcrypt salt drawn from the generator instead of the system, keeping the password hashes deterministic."""
+        chars = ''.join(rng.choice(bcrypt_alphabet) for _ in range(21)) + rng.choice('.Oeu')
+        return f"$2b${self.password_rounds:02d}${chars}".encode('utf-8')
+
+    def _insert(self, con, model, rows) -> int:
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                con.execute(model.__table__.insert(), batch)
+                count += len(batch)
+                batch = []
+        if len(batch) > 0:
+            con.execute(model.__table__.insert(), batch)
+            count += len(batch)
+        return count
+
+    def _ago(self, rng: Random, low_days: float, high_days: float) -> datetime:
+        return self.now - timedelta(seconds=int(rng.uniform(low_days, high_days) * 86400))
+
+    def generate(self, con) -> dict:
+        """Writes the dataset into the tables of the models, which are expected to be empty, returns row counts."""
+        counts = dict()
+        rng = self._random('catalog')
+        book_weights = skewed_cum_weights(rng, self.books, 1.0)
+        customer_weights = skewed_cum_weights(rng, self.customers, 0.6)
+        available = [rng.random() >= 0.05 for _ in range(self.books)]
+        pw_hash = bcrypt.hashpw(b'password', self._salt(rng)).decode('utf-8')
+        next_address_id = con.execute(select(func.coalesce(func.max(Address.__table__.c.id), 0))).scalar() + 1
+
+        campus_ids = list(range(next_address_id, next_address_id + self.campuses))
+        campus_addresses = [Address(street=streets[index % len(streets)], number=str(index + 1),
+                                    city=cities[index % len(cities)][0], post_code=cities[index % len(cities)][1],
+                                    country='Denmark') for index in range(self.campuses)]
+        counts['address'] = self._insert(con, Address, (get_row(address, id=address_id)
+                                                        for address, address_id in zip(campus_addresses, campus_ids)))
+        counts['campus'] = self._insert(con, Campus, (get_row(Campus(address=address), address_id=address_id)
+                                                      for address, address_id in zip(campus_addresses, campus_ids)))
+        next_address_id += self.campuses
+        librarian_ssns = [f"L{index:09d}" for index in range(self.librarians)]
+        counts['librarian'] = self._insert(con, Librarian, (
+            get_row(Librarian(ssn=ssn, email=f"librarian{index}@gtl.dk", password=pw_hash,
+                              first_name=first_names[index % len(first_names)],
+                              last_name=last_names[index % len(last_names)],
+                              campus=campus_ids[index % len(campus_ids)],
+                              position='CHIEF' if index < len(campus_ids) else 'LIBRARIAN'))
+            for index, ssn in enumerate(librarian_ssns)))
+
+        open_loans = self._generate_open_loans(book_weights, customer_weights, available, librarian_ssns)
+        wishlist = self._generate_wishlist(book_weights, customer_weights)
+        counts['book'] = self._insert(con, Book, self._generate_books(open_loans, available))
+        for model, rows in self._generate_customers(open_loans, wishlist, campus_ids, next_address_id, pw_hash):
+            counts[model.__table__.name] = counts.get(model.__table__.name, 0) + self._insert(con, model, rows)
+        counts['customer_wishlist_item'] = self._insert(con, CustomerWishlistItem, wishlist)
+        counts['loan'] = self._insert(con, Loan, open_loans)
+        counts['loan'] += self._insert(con, Loan, self._generate_closed_loans(book_weights, customer_weights,
+                                                                              librarian_ssns))
+        counts['overdue_loan'] = sum(loan['loaned_at'] < self.now - timedelta(days=self.grace_period_days)
+                                     for loan in open_loans)
+        return counts
+
+    def _generate_open_loans(self, book_weights, customer_weights, available, librarian_ssns) -> list[dict]:
+        rng = self._random('open_loans')
+        total = round(self.loans * self.open_ratio)
+        overdue = round(total * self.overdue_ratio)
+        books = [index for index in rng.choices(range(self.books), cum_weights=book_weights, k=total * 2)
+                 if available[index]][:total]
+        customers = rng.choices(range(self.customers), cum_weights=customer_weights, k=len(books))
+        loans = []
+        for number, (book, customer) in enumerate(zip(books, customers)):
+            loaned_at = self._ago(rng, self.grace_period_days, min(self.days, 365)) if number < overdue \
+                else self._ago(rng, 0, self.grace_period_days)
+            loans.append(get_row(Loan(book_isbn=isbn13(book), customer_ssn=f"{customer:010d}",
+                                      issued_by=rng.choice(librarian_ssns), loaned_at=loaned_at),
+                                 id=self._uuid(rng)))
+        return loans
+
+    def _generate_wishlist(self, book_weights, customer_weights) -> list[dict]:
+        """Items unique per customer and book, some requested as reservations and some of those picked up."""
+        rng = self._random('wishlist')
+        pairs = dict()
+        while len(pairs) < self.wishlist_items:
+            missing = self.wishlist_items - len(pairs)
+            books = rng.choices(range(self.books), cum_weights=book_weights, k=missing)
+            customers = rng.choices(range(self.customers), cum_weights=customer_weights, k=missing)
+            for pair in zip(customers, books):
+                pairs.setdefault(pair, None)
+        items = []
+        for customer, book in pairs:
+            requested_at = self._ago(rng, 0, 40) if rng.random() < 0.15 else None
+            items.append(get_row(CustomerWishlistItem(id=self._uuid(rng), customer_ssn=f"{customer:010d}",
+                                                      book_isbn=isbn13(book), requested_at=requested_at,
+                                                      picked_up=requested_at is not None and rng.random() < 0.3)))
+        return items
+
+    def _generate_books(self, open_loans: list[dict], available: list[bool]):
+        rng = self._random('books')
+        loaned = dict()
+        for loan in open_loans:
+            loaned[loan['book_isbn']] = loaned.get(loan['book_isbn'], 0) + 1
+        for index in range(self.books):
+            isbn = isbn13(index)
+            copies = loaned.get(isbn, 0) + min(int(rng.paretovariate(1.5)), 20)
+            title = ' '.join(rng.choice(words) for _ in range(rng.randint(2, 5))).capitalize()
+            yield get_row(Book(isbn=isbn, title=title[:150],
+                               author=f"{rng.choice(first_names)} {rng.choice(last_names)}",
+                               subject_area=rng.choice(subject_areas),
+                               description=f"{title} ({index})" if rng.random() < 0.5 else None,
+                               is_loanable=available[index] or rng.random() < 0.5, total_copies=copies,
+                               available_copies=copies - loaned.get(isbn, 0),
+                               resource_type=rng.choices(resource_types, weights=resource_type_weights)[0],
+                               deleted=not available[index] and rng.random() < 0.5))
+
+    def _generate_customers(self, open_loans: list[dict], wishlist: list[dict], campus_ids: list[int],
+                            first_address_id: int, pw_hash: str):
+        """Pairs of model and rows, the addresses of a batch of customers are written before the customers."""
+        rng = self._random('customers')
+        borrowed = dict()
+        for loan in open_loans:
+            borrowed[loan['customer_ssn']] = borrowed.get(loan['customer_ssn'], 0) + 1
+        reserved = dict()
+        for item in wishlist:
+            if item['requested_at'] is not None and not item['picked_up']:
+                reserved[item['customer_ssn']] = reserved.get(item['customer_ssn'], 0) + 1
+        for start in range(0, self.customers, self.batch_size):
+            addresses, customers, phone_numbers, cards = [], [], [], []
+            for index in range(start, min(start + self.batch_size, self.customers)):
+                ssn = f"{index:010d}"
+                city, post_code = rng.choice(cities)
+                address = Address(street=rng.choice(streets), number=str(rng.randint(1, 200)), city=city,
+                                  post_code=post_code, country='Denmark')
+                numbers = [PhoneNumber(customer_ssn=ssn, country_code='45', number=f"{rng.randrange(10 ** 8):08d}",
+                                       type=phone_type) for phone_type in ['MOBILE', 'HOME'][:rng.randint(1, 2)]]
+                customer = Customer(ssn=ssn, email=f"customer{index}@gtl.dk", pw_hash=pw_hash,
+                                    first_name=rng.choice(first_names), last_name=rng.choice(last_names),
+                                    campus_id=rng.choice(campus_ids),
+                                    type='PROFESSOR' if rng.random() < 0.05 else 'STUDENT', cards=[],
+                                    books_borrowed=borrowed.get(ssn, 0), books_reserved=reserved.get(ssn, 0),
+                                    is_active=rng.random() >= 0.02, phone_numbers=numbers, address=address)
+                addresses.append(get_row(address, id=first_address_id + index))
+                customers.append(get_row(customer, home_address_id=first_address_id + index))
+                phone_numbers += [get_row(number) for number in numbers]
+                if rng.random() < 0.1:
+                    cards.append(get_row(Card(customer_ssn=ssn, expiration_date=(self.now - timedelta(
+                        days=rng.randint(1, 1000))).date(), is_active=False), id=self._uuid(rng)))
+                cards.append(get_row(Card(customer_ssn=ssn, expiration_date=(self.now + timedelta(
+                    days=rng.randint(1, 365))).date(), is_active=customer.is_active), id=self._uuid(rng)))
+            yield Address, addresses
+            yield Customer, customers
+            yield PhoneNumber, phone_numbers
+            yield Card, cards
+
+    def _generate_closed_loans(self, book_weights, customer_weights, librarian_ssns):
+        """Loans spread over the history with more of them recently, returned mostly within the grace period."""
+        rng = self._random('closed_loans')
+        total = self.loans - round(self.loans * self.open_ratio)
+        for start in range(0, total, self.batch_size):
+            size = min(self.batch_size, total - start)
+            books = rng.choices(range(self.books), cum_weights=book_weights, k=size)
+            customers = rng.choices(range(self.customers), cum_weights=customer_weights, k=size)
+            for book, customer in zip(books, customers):
+                age = self.days * (1 - rng.random() ** 0.5)
+                duration = min(rng.gammavariate(2, 7) + 0.05, age * rng.random())
+                loaned_at = self.now - timedelta(seconds=int(age * 86400))
+                yield get_row(Loan(book_isbn=isbn13(book), customer_ssn=f"{customer:010d}",
+                                   issued_by=rng.choice(librarian_ssns), loaned_at=loaned_at,
+                                   returned_at=loaned_at + timedelta(seconds=int(duration * 86400))),
+                              id=self._uuid(rng))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--database', required=True, help='SQLAlchemy URI of a database without data.')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--books', type=int, default=200000)
+    parser.add_argument('--customers', type=int, default=200000)
+    parser.add_argument('--loans', type=int, default=1000000)
+    parser.add_argument('--wishlist-items', type=int, default=300000)
+    parser.add_argument('--open-ratio', type=float, default=0.05, help='Share of loans not returned yet.')
+    parser.add_argument('--overdue-ratio', type=float, default=0.2, help='Share of open loans past the grace period.')
+    parser.add_argument('--days', type=int, default=5 * 365, help='Length of the loan history.')
+    parser.add_argument('--today', type=date.fromisoformat, default=date.today())
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    options = {'fast_executemany': True} if args.database.startswith('mssql+pyodbc') else dict()
+    engine = create_engine(args.database, **options)
+    Base.metadata.create_all(engine)
+    with engine.connect() as con:
+        if con.execute(select(func.count()).select_from(Book.__table__)).scalar() > 0:
+            raise SystemExit('The database contains books already.')
+    generator = DatasetGenerator(seed=args.seed, books=args.books, customers=args.customers, loans=args.loans,
+                                 wishlist_items=args.wishlist_items, open_ratio=args.open_ratio,
+                                 overdue_ratio=args.overdue_ratio, days=args.days, today=args.today,
+                                 batch_size=args.batch_size)
+    started = perf_counter()
+    with engine.begin() as con:
+        counts = generator.generate(con)
+    for table, count in counts.items():
+        print(f"{table:24} {count:>10}")
+    print(f"generated in {perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Saturates the customer login with bcrypt verification while probing a cheap endpoint, once with hashing inline
+in the request threads and once through the password pool, and prints login throughput and probe latency.
+
+    python -m benchmarks.login_throughput --login-threads 16 --seconds 10
+"""
+import os
+from argparse import ArgumentParser
+from tempfile import mkdtemp
+from threading import Event, Thread
+from time import perf_counter
+import bcrypt
+from server import db
+from server.models import Address, Campus, Customer, PhoneNumber
+from benchmarks.support import create_benchmark_app
+
+
+def populate(app, customers: int, rounds: int) -> None:
+    with app.app_context():
+        campus = Campus(address=Address(city='Aalborg', post_code='9000', country='Denmark'))
+        db.session.add(campus)
+        db.session.flush()
+        pw_hash = bcrypt.hashpw(b'password', bcrypt.gensalt(rounds)).decode('utf-8')
+        for number in range(customers):
+            ssn = f"{number:010d}"
+            db.session.add(Customer(ssn=ssn, email=f"{ssn}@gtl.dk", pw_hash=pw_hash, first_name='Peter',
+                                    last_name='Sagan', campus_id=campus.address_id, cards=[],
+                                    address=Address(city='Aalborg', post_code='9000', country='Denmark'),
+                                    phone_numbers=[PhoneNumber(customer_ssn=ssn, country_code='45', number='1')]))
+        db.session.commit()
+
+
+def percentile(samples: list[float], share: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))] if len(ordered) > 0 else float('nan')
+
+
+def run(app, login_threads: int, customers: int, seconds: float) -> None:
+    stopped = Event()
+    logins = {'ok': 0, 'overloaded': 0, 'failed': 0}
+    probes = []
+
+    def login(number: int):
+        while not stopped.is_set():
+            email = f"{number % customers:010d}@gtl.dk"
+            response = app.test_client().post('/user/login', json={'email': email, 'password': 'password'})
+            key = 'ok' if response.status_code == 200 and response.json['ok'] \
+                else 'overloaded' if response.status_code == 503 else 'failed'
+            logins[key] += 1
+
+    def probe():
+        client = app.test_client()
+        while not stopped.is_set():
+            started = perf_counter()
+            client.get('/library/static/campuses')
+            probes.append((perf_counter() - started) * 1000)
+
+    threads = [Thread(target=login, args=(number,)) for number in range(login_threads)] + [Thread(target=probe)]
+    for thread in threads:
+        thread.start()
+    stopped.wait(seconds)
+    stopped.set()
+    for thread in threads:
+        thread.join()
+    print(f"  logins/s {logins['ok'] / seconds:8.1f}  rejected with 503 {logins['overloaded']:6d}  "
+          f"failed {logins['failed']:4d}")
+    print(f"  campuses probe: {len(probes) / seconds:8.1f} req/s  p50 {percentile(probes, 0.5):8.2f}ms  "
+          f"p99 {percentile(probes, 0.99):8.2f}ms")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--login-threads', type=int, default=16)
+    parser.add_argument('--customers', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rounds', type=int, default=12)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max-pending', type=int, default=0)
+    args = parser.parse_args()
+
+    database = f"sqlite:///{os.path.join(mkdtemp(), 'logins.sqlite')}"
+    for name, workers, max_pending in [('inline', 0, 10 ** 6), ('process pool', args.workers, args.max_pending)]:
+        app = create_benchmark_app(database, PASSWORD_POOL_WORKERS=workers, PASSWORD_POOL_MAX_PENDING=max_pending,
+                                   BCRYPT_LOG_ROUNDS=args.rounds)
+        if name == 'inline':
+            populate(app, args.customers, args.rounds)
+        print(f"{name}: {args.login_threads} login threads, bcrypt cost {args.rounds}")
+        run(app, args.login_threads, args.customers, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
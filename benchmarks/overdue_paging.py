@@ -0,0 +1,88 @@
+"""
+Compares OFFSET paging with keyset paging of overdue loans at increasing depths on a SQLite stand-in
+of the not_returned_loans view.
+
+    python -m benchmarks.overdue_paging --loans 2000000
+"""
+import os
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from random import Random
+from tempfile import mkdtemp
+from time import perf_counter
+from uuid import UUID
+from sqlalchemy import Column, DateTime, Index, MetaData, String, Table, create_engine
+from server.main.pagination import encode_cursor, fetch_overdue_loans_page, overdue_loans_query, overdue_page_size
+
+metadata = MetaData()
+
+not_returned_loans = Table(
+    'not_returned_loans',
+    metadata,
+    Column('id', String(36), primary_key=True),
+    Column('book_isbn', String(30), nullable=False),
+    Column('customer_ssn', String(20), nullable=False),
+    Column('loaned_at', DateTime, nullable=False),
+    Column('grace_period_end', DateTime, nullable=False),
+    Index('ix_not_returned_loans_grace_period_end_id', 'grace_period_end', 'id'),
+)
+
+
+def populate(engine, size: int, seed: int) -> None:
+    rng = Random(seed)
+    now = datetime.now()
+    with engine.begin() as con:
+        for start in range(0, size, 50000):
+            rows = []
+            for _ in range(start, min(size, start + 50000)):
+                loaned_at = now - timedelta(minutes=rng.randrange(60 * 24 * 365 * 5))
+                rows.append({
+                    'id': str(UUID(int=rng.getrandbits(128))),
+                    'book_isbn': f"{rng.randrange(200000):013d}",
+                    'customer_ssn': f"{rng.randrange(100000):010d}",
+                    'loaned_at': loaned_at,
+                    'grace_period_end': loaned_at + timedelta(days=28),
+                })
+            con.execute(not_returned_loans.insert(), rows)
+
+
+def timed(call, repeat: int = 5) -> float:
+    best = None
+    for _ in range(repeat):
+        started = perf_counter()
+        call()
+        elapsed = (perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--loans', type=int, default=2000000)
+    parser.add_argument('--pages', type=int, nargs='+', default=[0, 10, 100, 1000, 10000, 50000])
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{os.path.join(mkdtemp(), 'overdue.sqlite')}")
+    metadata.create_all(engine)
+    started = perf_counter()
+    populate(engine, args.loans, args.seed)
+    print(f"{args.loans} loans inserted in {perf_counter() - started:.1f}s")
+
+    with engine.connect() as con:
+        print(f"{'page':>8} {'offset ms':>12} {'keyset ms':>12}")
+        for page in args.pages:
+            cursor = None
+            if page > 0:
+                previous = con.execute(overdue_loans_query(not_returned_loans).offset(page * overdue_page_size - 1).limit(1)).first()
+                if previous is None:
+                    break
+                cursor = encode_cursor(previous['grace_period_end'], previous['id'])
+            offset_ms = timed(lambda: con.execute(
+                overdue_loans_query(not_returned_loans).offset(page * overdue_page_size).limit(overdue_page_size)).fetchall())
+            keyset_ms = timed(lambda: fetch_overdue_loans_page(con, cursor, not_returned_loans))
+            print(f"{page:>8} {offset_ms:>12.2f} {keyset_ms:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
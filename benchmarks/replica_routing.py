@@ -0,0 +1,116 @@
+"""
+Checks the routing of read-only requests to replicas with a primary and a replica SQLite file whose copies of one
+book differ: reads go to the replica, reads right after a write go to the primary until the fence expires, and an
+unreachable replica is skipped and probed again after REPLICA_RETRY_SECONDS, while a reachable one is probed on
+the first pick only. Exits with 1 when a check fails.
+
+    python -m benchmarks.replica_routing
+"""
+import os
+import shutil
+from tempfile import mkdtemp
+from time import sleep
+from sqlalchemy import create_engine
+from server import db
+from server.models import Book
+from benchmarks.dataset import DatasetGenerator
+from benchmarks.support import create_benchmark_app
+
+fence_seconds = 0.5
+retry_seconds = 0.5
+
+
+def create_databases(directory: str) -> tuple[str, str, str]:
+    """Primary and replica holding the same dataset, except the title of the first book."""
+    primary = os.path.join(directory, 'primary.sqlite')
+    app = create_benchmark_app(f"sqlite:///{primary}", BCRYPT_LOG_ROUNDS=4)
+    with app.app_context():
+        DatasetGenerator(books=100, customers=20, loans=200, wishlist_items=20).generate(db.session.connection())
+        db.session.commit()
+        isbn = db.session.query(Book.isbn).order_by(Book.isbn).first().isbn
+        db.session.remove()
+        db.engine.dispose()
+    replica = os.path.join(directory, 'replica.sqlite')
+    shutil.copy(primary, replica)
+    engine = create_engine(f"sqlite:///{replica}")
+    with engine.begin() as con:
+        con.execute(Book.__table__.update().where(Book.__table__.c.isbn == isbn).values(title='replica'))
+    engine.dispose()
+    return f"sqlite:///{primary}", f"sqlite:///{replica}", isbn
+
+
+def create_client(primary: str, replicas: list[str]):
+    app = create_benchmark_app(primary, SQLALCHEMY_REPLICA_URIS=replicas, REPLICA_RETRY_SECONDS=retry_seconds,
+                               REPLICA_READ_AFTER_WRITE_SECONDS=fence_seconds, BCRYPT_LOG_ROUNDS=4,
+                               PASSWORD_POOL_WORKERS=0, POPULAR_BOOKS_RECONCILE_SECONDS=0)
+    client = app.test_client()
+    response = client.post('/library/login', json={'email': 'librarian0@gtl.dk', 'password': 'password'})
+    assert response.json['ok'], response.json
+    return app, client
+
+
+def count_probes(app) -> list:
+    """Probe counts of the replicas of the application, updated as they are probed."""
+    counts = []
+    for index, replica in enumerate(app.extensions['replicas'].replicas):
+        counts.append(0)
+
+        def probe(index=index, probe=replica.probe):
+            counts[index] += 1
+            return probe()
+
+        replica.probe = probe
+    return counts
+
+
+def get_title(client, isbn: str) -> str:
+    return client.get(f"/api/book/{isbn}").json['data']['title']
+
+
+def check(name: str, condition: bool, failures: list) -> None:
+    print(f"{'ok' if condition else 'FAILED':6} {name}")
+    if not condition:
+        failures.append(name)
+
+
+def run(directory: str) -> list:
+    primary, replica, isbn = create_databases(directory)
+    failures = []
+
+    app, client = create_client(primary, [replica])
+    probes = count_probes(app)
+    check('read served by the replica', get_title(client, isbn) == 'replica', failures)
+    check('next read served by the replica', get_title(client, isbn) == 'replica', failures)
+    check('reachable replica probed on the first pick only', probes == [1], failures)
+    response = client.post(f"/api/book/{isbn}/update", json={'description': 'changed on the primary'})
+    check('write served by the primary', response.json['ok'], failures)
+    check('read after the write served by the primary', get_title(client, isbn) != 'replica', failures)
+    sleep(fence_seconds + 0.1)
+    check('read after the fence served by the replica', get_title(client, isbn) == 'replica', failures)
+
+    missing = f"sqlite:///{os.path.join(directory, 'missing', 'replica.sqlite')}"
+    app, client = create_client(primary, [missing, replica])
+    replicas = app.extensions['replicas'].replicas
+    probes = count_probes(app)
+    titles = [get_title(client, isbn) for _ in range(4)]
+    check('unreachable replica skipped', titles == ['replica'] * 4, failures)
+    check('unreachable replica marked down once', replicas[0].failures == 1, failures)
+    check('reachable replica serves every read', replicas[1].picks == 4, failures)
+    check('replica marked down not probed before the retry', probes == [1, 1], failures)
+    sleep(retry_seconds + 0.1)
+    get_title(client, isbn)
+    check('replica marked down probed after the retry', probes[0] == 2 and replicas[0].failures == 2, failures)
+
+    app, client = create_client(primary, [missing])
+    check('read falls back to the primary without replicas left', get_title(client, isbn) != 'replica', failures)
+    return failures
+
+
+def main():
+    failures = run(mkdtemp())
+    if len(failures) > 0:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
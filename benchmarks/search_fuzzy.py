@@ -0,0 +1,99 @@
+"""
+Compares recall and latency of the exact inverted index with the trigram fuzzy index on a synthetic catalog.
+
+    python -m benchmarks.search_fuzzy --books 1000000 --queries 500
+"""
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+from server.models import Book
+from server.search.engine import InvertedIndexSearchBackend
+from server.search.fuzzy import FuzzySearch
+from server.search.routes import SearchRequest, groups
+
+consonants = 'bcdfghjklmnprstvwz'
+vowels = 'aeiouy'
+
+
+def word(rng: Random) -> str:
+    return ''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.randint(2, 4)))
+
+
+def catalog(rng: Random, size: int) -> list[Book]:
+    first_names = [word(rng).capitalize() for _ in range(2000)]
+    last_names = [word(rng).capitalize() for _ in range(20000)]
+    vocabulary = [word(rng) for _ in range(50000)]
+    return [Book(isbn=f"{number:013d}",
+                 title=' '.join(rng.choice(vocabulary) for _ in range(rng.randint(2, 6))).capitalize(),
+                 author=f"{rng.choice(first_names)} {rng.choice(last_names)}",
+                 subject_area='Synthetic', resource_type=rng.choice(groups[1:]))
+            for number in range(size)]
+
+
+def misspell(rng: Random, value: str) -> str:
+    position = rng.randrange(1, len(value) - 1)
+    edit = rng.choice(['delete', 'substitute', 'transpose'])
+    if edit == 'delete':
+        return value[:position] + value[position + 1:]
+    if edit == 'substitute':
+        return value[:position] + rng.choice('aeiouklmnrst') + value[position + 1:]
+    return value[:position - 1] + value[position] + value[position - 1] + value[position + 1:]
+
+
+def percentile(samples: list[float], share: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def measure(name: str, search, queries: list[tuple[str, str]]) -> None:
+    latencies = []
+    found = 0
+    for phrase, isbn in queries:
+        started = perf_counter()
+        isbns = search(phrase)
+        latencies.append((perf_counter() - started) * 1000)
+        found += isbn in isbns
+    print(f"{name:<24} recall={found / len(queries):6.1%}  p50={percentile(latencies, 0.5):8.2f}ms  "
+          f"p99={percentile(latencies, 0.99):8.2f}ms")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--books', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = Random(args.seed)
+    books = catalog(rng, args.books)
+    exact = InvertedIndexSearchBackend()
+    fuzzy = FuzzySearch(budget_ms=args.budget_ms)
+    started = perf_counter()
+    exact.load(books)
+    print(f"exact index built in {perf_counter() - started:.1f}s")
+    started = perf_counter()
+    fuzzy.load(books)
+    print(f"fuzzy index built in {perf_counter() - started:.1f}s")
+
+    targets = rng.sample(books, args.queries)
+    clean = [(target.author, target.isbn) for target in targets]
+    typos = [(misspell(rng, target.author), target.isbn) for target in targets]
+
+    def exact_search(phrase: str) -> list[str]:
+        req = SearchRequest(offset=0, limit=args.limit, phrase=phrase, group='EVERYTHING', columns=['AUTHOR'])
+        return exact.rank(req)
+
+    def fuzzy_search(phrase: str) -> list[str]:
+        return fuzzy.rank(phrase, ['AUTHOR'], 'EVERYTHING', 0, args.limit)
+
+    print(f"{args.books} books, {args.queries} author queries, top {args.limit}")
+    measure('exact / clean', exact_search, clean)
+    measure('fuzzy / clean', fuzzy_search, clean)
+    measure('exact / misspelled', exact_search, typos)
+    measure('fuzzy / misspelled', fuzzy_search, typos)
+
+
+if __name__ == '__main__':
+    main()
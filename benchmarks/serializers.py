@@ -0,0 +1,70 @@
+"""
+Encodes 10k Book and Loan views with the compiled serializers and with the dict views dumped by flask.json,
+checks that both produce the same text and prints the timings.
+
+    python -m benchmarks.serializers --items 10000
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from random import Random
+from time import perf_counter
+from flask import Flask, json
+from server.models import Book, Loan
+from server.serializers import book_relaxed_view, loan_relaxed_view
+
+
+def books(rng: Random, size: int) -> list[Book]:
+    return [Book(isbn=f"{number:013d}", title=f"Title ř {rng.random()}", author=f"Author {number}",
+                 subject_area='Area', description=None if number % 3 else 'Lorem "ipsum"\n',
+                 total_copies=rng.randrange(10), available_copies=rng.randrange(10),
+                 resource_type='BOOK', is_loanable=bool(number % 2), deleted=number % 7 == 0)
+            for number in range(size)]
+
+
+def loans(rng: Random, catalog: list[Book]) -> list[Loan]:
+    result = []
+    for number, book in enumerate(catalog):
+        loaned_at = datetime(2021, 1, 1) + timedelta(seconds=rng.randrange(10 ** 8), microseconds=rng.randrange(10 ** 6))
+        loan = Loan(book_isbn=book.isbn, customer_ssn=f"{number:010d}", issued_by='librarian', loaned_at=loaned_at,
+                    returned_at=None if number % 4 else loaned_at + timedelta(days=rng.randrange(60)))
+        loan.id = f"{number:08x}-0000-0000-0000-000000000000"
+        loan.book = book
+        result.append(loan)
+    return result
+
+
+def best_of(call, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = perf_counter()
+        call()
+        timings.append((perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = Random(42)
+    catalog = books(rng, args.items)
+    history = loans(rng, catalog)
+    with Flask(__name__).app_context():
+        for name, items, serializer in [('Book', catalog, book_relaxed_view), ('Loan', history, loan_relaxed_view)]:
+            def current():
+                return json.dumps([item.get_relaxed_view() for item in items])
+
+            def compiled():
+                return serializer.encode_many(items)
+
+            assert current() == compiled(), f"{name} serializer output differs from get_relaxed_view"
+            current_ms = best_of(current, args.repeat)
+            compiled_ms = best_of(compiled, args.repeat)
+            print(f"{name:<5} {len(items)} views: get_relaxed_view + json.dumps {current_ms:8.1f}ms, "
+                  f"compiled serializer {compiled_ms:8.1f}ms ({current_ms / compiled_ms:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Exercises every blueprint through the Flask test client against a generated SQLite database and records
+p50/p95/p99 latency and queries per request of each scenario. Results are compared with a stored baseline,
+the run exits with status 1 when a scenario got slower than the tolerance allows or runs more queries.
+
+    python -m benchmarks.suite                         # compare with benchmarks/baseline.json
+    python -m benchmarks.suite --save-baseline         # record a new baseline
+    python -m benchmarks.suite --only search --requests 200
+"""
+import json
+import os
+from argparse import ArgumentParser
+from tempfile import mkdtemp
+from time import perf_counter
+from sqlalchemy import select
+from server import db
+from server.main.reservations import open_reservations
+from server.models import Book, Card, Customer, Loan
+from benchmarks.dataset import DatasetGenerator, words
+from benchmarks.support import create_benchmark_app, recorded_queries
+
+baseline_path = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def populate(app, books: int, customers: int, loans: int, seed: int) -> dict:
+    """Fills the database with a deterministic dataset, returns the keys the scenarios refer to."""
+    generator = DatasetGenerator(seed=seed, books=books, customers=customers, loans=loans,
+                                 wishlist_items=books)
+    with app.app_context():
+        con = db.session.connection()
+        generator.generate(con)
+        book, card, loan = Book.__table__, Card.__table__, Loan.__table__
+        keys = {
+            'isbns': con.execute(select(book.c.isbn).where(book.c.deleted == False, book.c.is_loanable == True)
+                                 .order_by(book.c.isbn)).scalars().all(),
+            'ssns': con.execute(select(Customer.__table__.c.ssn).order_by(Customer.__table__.c.ssn)).scalars().all(),
+            'cards': con.execute(select(card.c.id).where(card.c.is_active == True).order_by(card.c.id))
+            .scalars().all(),
+            'open_loans': con.execute(select(loan.c.id).where(loan.c.returned_at == None).order_by(loan.c.id))
+            .scalars().all(),
+            'reservations': [reservation.id for reservation in open_reservations()],
+        }
+        db.session.commit()
+    return keys
+
+
+def get_scenarios(keys: dict) -> list[tuple]:
+    """(name, client, method, path, json) where path and json are functions of the request number."""
+    isbn = lambda i: keys['isbns'][(i * 7919) % len(keys['isbns'])]
+    ssn = lambda i: keys['ssns'][(i * 104729) % len(keys['ssns'])]
+    search = lambda mode: lambda i: {'phrase': words[i % len(words)], 'columns': ['TITLE', 'AUTHOR'],
+                                     'group': 'EVERYTHING', 'offset': 0, 'limit': 20, 'mode': mode}
+    return [
+        ('search', 'anonymous', 'POST', lambda i: '/search/', search('EXACT')),
+        ('search fuzzy', 'anonymous', 'POST', lambda i: '/search/', search('FUZZY')),
+        ('book get', 'librarian', 'GET', lambda i: f"/api/book/{isbn(i)}", None),
+        ('book find', 'librarian', 'GET', lambda i: f"/api/book/find/{isbn(i)[:9]}", None),
+        ('book stock', 'librarian', 'POST', lambda i: f"/api/book/{isbn(i)}/stock", lambda i: {'total_copies': 1000}),
+        ('loan start', 'librarian', 'PUT', lambda i: '/api/loan/start', lambda i: {'ssn': ssn(i), 'isbn': isbn(i)}),
+        ('loan close', 'librarian', 'GET',
+         lambda i: f"/api/loan/close/{keys['open_loans'][i % len(keys['open_loans'])]}", None),
+        ('customer get', 'librarian', 'GET', lambda i: f"/api/customer/{ssn(i)}", None),
+        ('customer find', 'librarian', 'GET', lambda i: f"/api/customer/find/{keys['cards'][i % len(keys['cards'])][:4]}",
+         None),
+        ('customer rentals', 'librarian', 'GET', lambda i: f"/api/customer/{ssn(i)}/rentals/active", None),
+        ('user history', 'customer', 'GET', lambda i: '/api/user/history', None),
+        ('user wishlist', 'customer', 'GET', lambda i: '/api/user/wishlist', None),
+        ('library wishlist', 'librarian', 'GET', lambda i: '/api/library/wishlist', None),
+        ('reservations', 'librarian', 'GET', lambda i: '/api/library/reservations/queue', None),
+        ('reservation accept', 'librarian', 'GET',
+         lambda i: f"/api/library/reservations/accept/{keys['reservations'][i % len(keys['reservations'])]}", None),
+        ('overdue loans', 'librarian', 'GET', lambda i: '/api/library/loans/overdue', None),
+        ('campuses', 'anonymous', 'GET', lambda i: '/library/static/campuses', None),
+        ('popular books', 'anonymous', 'GET', lambda i: '/v1/statistics/books/popular/10', None),
+        ('average loan time', 'anonymous', 'GET', lambda i: '/v1/statistics/loans/averageTimeInDays', None),
+        ('pool metrics', 'librarian', 'GET', lambda i: '/api/internal/pool', None),
+        ('metrics', 'anonymous', 'GET', lambda i: '/metrics', None),
+    ]
+
+
+def percentile(samples: list[float], share: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def run(app, keys: dict, requests: int, warmup: int, only: str = None) -> dict:
+    clients = {'anonymous': app.test_client(), 'librarian': app.test_client(), 'customer': app.test_client()}
+    clients['librarian'].post('/library/login', json={'email': 'librarian0@gtl.dk', 'password': 'password'})
+    clients['customer'].post('/user/login', json={'email': 'customer0@gtl.dk', 'password': 'password'})
+    results = dict()
+    with app.app_context():
+        engine = db.engine
+    for name, client, method, path, body in get_scenarios(keys):
+        if only is not None and only not in name:
+            continue
+        latencies = []
+        queries = 0
+        failed = 0
+        for i in range(warmup + requests):
+            with recorded_queries(engine) as statements:
+                started = perf_counter()
+                response = clients[client].open(path(i), method=method, json=body(i) if body else None)
+                elapsed = (perf_counter() - started) * 1000
+            if i < warmup:
+                continue
+            latencies.append(elapsed)
+            queries += len(statements)
+            failed += response.status_code >= 400
+        results[name] = {
+            'p50_ms': round(percentile(latencies, 0.5), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'queries': round(queries / requests, 2),
+            'failed': failed,
+        }
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float, noise_ms: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        limit = max(expected['p95_ms'] * (1 + tolerance), expected['p95_ms'] + noise_ms)
+        if result['p95_ms'] > limit:
+            regressions.append(f"{name}: p95 {result['p95_ms']}ms, baseline {expected['p95_ms']}ms")
+        if result['queries'] > expected['queries']:
+            regressions.append(f"{name}: {result['queries']} queries per request, baseline {expected['queries']}")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--customers', type=int, default=500)
+    parser.add_argument('--loans', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--only', default=None, help='Runs the scenarios with the text in their name only.')
+    parser.add_argument('--search-backend', default='index', choices=['procedure', 'index'])
+    parser.add_argument('--baseline', default=baseline_path)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed relative p95 growth.')
+    parser.add_argument('--noise-ms', type=float, default=2, help='Allowed absolute p95 growth.')
+    args = parser.parse_args()
+
+    database = f"sqlite:///{os.path.join(mkdtemp(), 'suite.sqlite')}"
+    app = create_benchmark_app(database, SEARCH_BACKEND=args.search_backend, BCRYPT_LOG_ROUNDS=4,
+                               PASSWORD_POOL_WORKERS=0, POPULAR_BOOKS_RECONCILE_SECONDS=0)
+    keys = populate(app, args.books, args.customers, args.loans, args.seed)
+    results = run(app, keys, args.requests, args.warmup, args.only)
+
+    baseline = dict()
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print(f"{'scenario':20} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'failed':>7} {'base p95':>9}")
+    for name, result in results.items():
+        base = baseline.get(name, {}).get('p95_ms', '')
+        print(f"{name:20} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} {result['p99_ms']:9.2f} "
+              f"{result['queries']:8.2f} {result['failed']:7d} {base:>9}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+            file.write('\n')
+        print(f"baseline saved to {args.baseline}")
+        return
+    regressions = compare(results, baseline, args.tolerance, args.noise_ms)
+    for regression in regressions:
+        print(f"regression: {regression}")
+    if len(regressions) > 0:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from server import create_app, db
+from server.config import Config
+from server.models import Base
+
+
+def create_benchmark_app(database_uri: str = 'sqlite://', **config):
+    """Creates the application on top of a SQLite database holding the schema of the models."""
+    config_class = type('BenchmarkConfig', (Config,), {
+        'SECRET_KEY': 'benchmark',
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SQLALCHEMY_ENGINE_OPTIONS': {},
+        'LOAN_DURATIONS_WARM_UP': False,
+        **config,
+    })
+    app = create_app(config_class)
+    with app.app_context():
+        Base.metadata.create_all(db.engine)
+    return app
+
+
+@contextmanager
+def recorded_queries(engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
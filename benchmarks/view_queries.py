@@ -0,0 +1,69 @@
+"""
+Checks that rendering customer and librarian views through the view loaders costs the same number of
+queries whatever the size of the wishlist, exits with status 1 otherwise.
+
+    python -m benchmarks.view_queries
+"""
+import sys
+from datetime import date, timedelta
+from uuid import uuid4
+from server import bcrypt, db
+from server.loaders import customer_relaxed_v1_view, customer_relaxed_view, librarian_relaxed_view
+from server.models import Address, Book, Campus, Card, Customer, CustomerWishlistItem, Librarian, PhoneNumber
+from benchmarks.support import create_benchmark_app, recorded_queries
+
+wishlist_sizes = [0, 1, 10, 100]
+
+
+def populate() -> None:
+    campus = Campus(address=Address(city='Aalborg', post_code='9000', country='Denmark'))
+    db.session.add(campus)
+    db.session.flush()
+    db.session.add(Librarian(ssn='librarian', email='librarian@gtl.dk', password=bcrypt.generate_password_hash('pw'),
+                             first_name='Rocky', last_name='Balboa', campus=campus.address_id, position='CHIEF'))
+    for number in range(max(wishlist_sizes)):
+        db.session.add(Book(isbn=f"isbn-{number}", title=f"Title {number}", author='Author', subject_area='Area',
+                            total_copies=1, available_copies=1))
+    for size in wishlist_sizes:
+        ssn = f"customer-{size}"
+        db.session.add(Customer(ssn=ssn, email=f"{ssn}@gtl.dk", pw_hash='hash', first_name='Peter', last_name='Sagan',
+                                campus_id=campus.address_id, cards=[],
+                                address=Address(city='Aalborg', post_code='9000', country='Denmark'),
+                                phone_numbers=[PhoneNumber(customer_ssn=ssn, country_code='45', number='12345678')]))
+        db.session.flush()
+        db.session.execute(Card.__table__.insert(), [{
+            'id': str(uuid4()), 'customer_ssn': ssn, 'expiration_date': date.today() + timedelta(days=365),
+            'photo_path': 'default.png', 'is_active': True,
+        }])
+        if size > 0:
+            db.session.execute(CustomerWishlistItem.__table__.insert(), [{
+                'id': str(uuid4()), 'customer_ssn': ssn, 'book_isbn': f"isbn-{number}", 'picked_up': False,
+            } for number in range(size)])
+    db.session.commit()
+
+
+def count(loader, view, ident) -> int:
+    db.session.expunge_all()
+    with recorded_queries(db.engine) as statements:
+        view(loader.get(ident))
+    return len(statements)
+
+
+def main():
+    app = create_benchmark_app()
+    failed = False
+    with app.app_context():
+        populate()
+        for name, loader, view in [('Customer.get_relaxed_view', customer_relaxed_view, Customer.get_relaxed_view),
+                                   ('Customer.get_relaxed_v1_view', customer_relaxed_v1_view,
+                                    Customer.get_relaxed_v1_view)]:
+            counts = [count(loader, view, f"customer-{size}") for size in wishlist_sizes]
+            failed |= len(set(counts)) > 1
+            print(f"{name:<30} queries per wishlist size {dict(zip(wishlist_sizes, counts))}")
+        print(f"{'Librarian.get_relaxed_view':<30} queries "
+              f"{count(librarian_relaxed_view, Librarian.get_relaxed_view, 'librarian')}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,13 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import registry
 from sqlalchemy.ext.automap import automap_base
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_mail import Mail
 from server.config import Config
+from server.replicas import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 # db_base = automap_base()
 # db_base = registry()
 bcrypt = Bcrypt()
@@ -17,9 +17,16 @@ mail = Mail()
 
 def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
 
+    from server.monitoring.pool import pool_metrics
+    from server.monitoring.metrics import metrics
+    from server.monitoring.queries import nplusone_detector
+
+    pool_metrics.init_app(app)
     db.init_app(app)
+    metrics.init_app(app)
+    nplusone_detector.init_app(app)
     # with app.app_context():
         # db.create_all()
         # db_base.prepare(db.engine, reflect=True)
@@ -35,6 +42,14 @@ def create_app(config_class=Config):
     from server.users.routes import users, users_unsecure
     from server.main.routes import main, main_unsecure
     from server.v1.routes import public_api
+    from server.monitoring.routes import monitoring
+    from server.search.engine import catalog_search
+    from server.cache.typeahead import typeahead
+    from server.cache.reference import reference_data
+    from server.v1.popularity import popular_books
+    from server.v1.loan_duration import loan_durations
+    from server.passwords import password_pool
+    from server.cache.identity import identity_cache
 
     app.register_blueprint(search)
     app.register_blueprint(books)
@@ -45,5 +60,24 @@ def create_app(config_class=Config):
     app.register_blueprint(main)
     app.register_blueprint(main_unsecure)
     app.register_blueprint(public_api)
+    app.register_blueprint(monitoring)
+
+    catalog_search.init_app(app)
+    typeahead.init_app(app)
+    reference_data.init_app(app)
+    popular_books.init_app(app)
+    loan_durations.init_app(app)
+    password_pool.init_app(app)
+    identity_cache.init_app(app)
+
+    if app.config.get('LOAN_DURATIONS_WARM_UP', False):
+        # backfilled at startup so every server gets the aggregate and its reconciliation before the first request
+        with app.app_context():
+            try:
+                loan_durations.warm_up()
+            except Exception as e:
+                app.logger.exception(e)
+            finally:
+                db.session.remove()
 
     return app
@@ -0,0 +1,160 @@
+"""
+ASGI variant of the application, every request runs in a pool of ASYNC_WORKER_THREADS threads on the regular
+engine. Responses are sent chunk by chunk with more_body, so the streamed lists (?stream=json or ?stream=ndjson)
+keep their memory bound. The structures built lazily on first use (search indexes, popular books, loan
+durations) are warmed up in the pool on lifespan startup.
+
+The read endpoints used to run on an asyncio engine inside AsyncConnection.run_sync, which was slower than WSGI
+threads in benchmarks/async_reads.py with and without database latency. A request is bound by the Python work of
+Flask, the views and the serialization rather than by its database round trips, and that work holds the GIL on the
+event loop as it does in threads. On the loop it also ran one request at a time, so a slow request held up every
+other one, and each statement paid for the hops to the thread of aiosqlite and back.
+
+    uvicorn asgi:app --workers 4
+"""
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from server import create_app, db
+from server.config import Config
+from server.search.engine import catalog_search
+from server.v1.loan_duration import loan_durations
+from server.v1.popularity import popular_books
+
+
+def get_environ(scope: dict, body: bytes) -> dict:
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ['CONTENT_TYPE', 'CONTENT_LENGTH']:
+            key = f"HTTP_{key}"
+        environ[key] = f"{environ[key]},{value.decode('latin-1')}" if key in environ and key.startswith('HTTP_') \
+            else value.decode('latin-1')
+    return environ
+
+
+def encode_headers(headers: list) -> list:
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+def call_wsgi(app, environ: dict) -> tuple[int, list, bytes]:
+    """Calls the WSGI application and collects the whole response."""
+    started = []
+
+    def start_response(status: str, headers: list, exc_info=None):
+        started[:] = [int(status.split(' ', 1)[0]), headers]
+
+    result = app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    status, headers = started
+    return status, encode_headers(headers), body
+
+
+def stream_wsgi(app, environ: dict, send) -> None:
+    """
+    Calls the WSGI application and sends the response as ASGI messages, one body message per chunk the application
+    yields. send is a blocking callable, the function runs in a worker thread.
+    """
+    started = []
+
+    def start_response(status: str, headers: list, exc_info=None):
+        started[:] = [int(status.split(' ', 1)[0]), headers]
+
+    def send_start():
+        send({'type': 'http.response.start', 'status': started[0], 'headers': encode_headers(started[1])})
+        started.append(True)
+
+    result = app(environ, start_response)
+    try:
+        for chunk in result:
+            if len(chunk) == 0:
+                continue
+            if len(started) < 3:
+                send_start()
+            send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    if len(started) < 3:
+        send_start()
+    send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+class AsyncApplication:
+    """ASGI application serving a Flask application in a thread pool."""
+
+    def __init__(self, app):
+        self.app = app
+        self.executor = ThreadPoolExecutor(app.config.get('ASYNC_WORKER_THREADS', 16),
+                                           thread_name_prefix='asgi-worker')
+
+    def warm_up(self) -> None:
+        """Builds the lazily built structures up front instead of on the first requests, runs in the thread pool."""
+        with self.app.app_context():
+            try:
+                catalog_search.warm_up()
+                popular_books.warm_up()
+                loan_durations.warm_up()
+            finally:
+                db.session.remove()
+
+    async def handle(self, environ: dict, send) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, stream_wsgi, self.app, environ,
+                                   lambda message: asyncio.run_coroutine_threadsafe(send(message), loop).result())
+
+    async def __call__(self, scope: dict, receive, send) -> None:
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise NotImplementedError(f"Unsupported ASGI scope {scope['type']}")
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        await self.handle(get_environ(scope, b''.join(chunks)), send)
+
+    async def lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await asyncio.get_running_loop().run_in_executor(self.executor, self.warm_up)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def close(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+def create_asgi_app(config_class=Config) -> AsyncApplication:
+    return AsyncApplication(create_app(config_class))
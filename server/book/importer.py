@@ -0,0 +1,173 @@
+import csv
+import io
+import json
+from time import perf_counter
+from flask import current_app
+from sqlalchemy import bindparam, select
+from sqlalchemy.exc import DBAPIError
+from server import db
+from server.config import Config, InvalidRequestException
+from server.models import Book
+
+import_formats = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+book_columns = [column.name for column in Book.__table__.columns]
+integer_columns = ['total_copies', 'available_copies']
+boolean_columns = ['is_loanable', 'deleted']
+
+
+def read_csv(stream) -> iter:
+    """Yields (row number, row) of a CSV feed with a header line, empty cells fall back to the Book defaults."""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for number, row in enumerate(reader, start=1):
+        if None in row:
+            yield number, InvalidRequestException('Row has more cells than the header!')
+            continue
+        yield number, {key: value for key, value in row.items() if value not in (None, '')}
+
+
+def read_ndjson(stream) -> iter:
+    """Yields (row number, row) of a feed with one JSON object per line, blank lines are skipped."""
+    number = 0
+    for line in io.TextIOWrapper(stream, encoding='utf-8'):
+        if line.strip() == '':
+            continue
+        number += 1
+        try:
+            row = json.loads(line)
+            yield number, row if isinstance(row, dict) else InvalidRequestException('Row is not an object!')
+        except ValueError:
+            yield number, InvalidRequestException('Row is not valid JSON!')
+
+
+readers = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+
+def to_book_values(row: dict) -> dict:
+    """Validates the row with the rules of Book.__init__ and returns the values of all book columns."""
+    row = dict(row)
+    try:
+        for column in integer_columns:
+            if column in row and not isinstance(row[column], int):
+                row[column] = int(row[column])
+        for column in boolean_columns:
+            if isinstance(row.get(column), str):
+                if row[column].lower() not in ['true', 'false', '1', '0']:
+                    raise ValueError
+                row[column] = row[column].lower() in ['true', '1']
+    except (TypeError, ValueError):
+        raise InvalidRequestException(f"Columns {', '.join(integer_columns + boolean_columns)} "
+                                      f"must be integers and booleans!")
+    book = Book(**row)
+    return {column: getattr(book, column) for column in book_columns}
+
+
+class BookImport:
+    """
+    Streams rows of a catalog feed into the book table in batches of batch_size rows.
+    Every batch is written with executemany in its own transaction of the session. A batch failing in the database
+    is retried row by row, so a bad row is reported with its number instead of aborting the import, the database
+    error itself is only logged.
+    Existing isbns are rejected, or updated in place when upsert is set. Updates only set the columns present in
+    the row, so stock counts are kept unless the feed carries them. Once a batch is committed its written books are
+    passed to books_changed in one call, as (book, resource_type before the update) pairs.
+    """
+
+    def __init__(self, batch_size: int = 1000, upsert: bool = False, books_changed=None):
+        self.batch_size = batch_size
+        self.upsert = upsert
+        self.books_changed = books_changed
+        self.inserted = 0
+        self.updated = 0
+        self.errors = []
+
+    def run(self, rows) -> dict:
+        started = perf_counter()
+        batch = dict()
+        for number, row in rows:
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                values = to_book_values(row)
+                if values['isbn'] in batch:
+                    raise InvalidRequestException(f"Isbn {values['isbn']} is repeated in the batch!")
+                batch[values['isbn']] = (number, values, frozenset(row) & set(book_columns))
+            except InvalidRequestException as e:
+                self.errors.append({'row': number, 'error': e.message})
+            if len(batch) >= self.batch_size:
+                self._flush(batch, started)
+                batch = dict()
+        if len(batch) > 0:
+            self._flush(batch, started)
+        return self.get_report(perf_counter() - started)
+
+    def _flush(self, batch: dict, started: float) -> None:
+        try:
+            results = [self._write(db.session.connection(), list(batch.values()))]
+            db.session.commit()
+        except DBAPIError:
+            db.session.rollback()
+            results = []
+            for item in batch.values():
+                try:
+                    results.append(self._write(db.session.connection(), [item]))
+                    db.session.commit()
+                except DBAPIError as e:
+                    db.session.rollback()
+                    current_app.logger.warning(f"book import: row {item[0]} rejected by the database: {e.orig}")
+                    self.errors.append({'row': item[0], 'error': Config.UNHANDLED_EXCEPTION_MESSAGE})
+        changes = []
+        for inserts, updates, rejected, existing in results:
+            self.inserted += len(inserts)
+            self.updated += len(updates)
+            self.errors += rejected
+            changes += [(Book(**values), existing.get(values['isbn'])) for values in inserts + updates]
+        if self.books_changed is not None and len(changes) > 0:
+            self.books_changed(changes)
+        elapsed = perf_counter() - started
+        current_app.logger.info(f"book import: {self.inserted + self.updated} rows written, {len(self.errors)} "
+                                f"rejected, {(self.inserted + self.updated) / max(elapsed, 1e-6):.0f} rows/s")
+
+    def _write(self, con, items: list) -> tuple:
+        """
+        Writes (row number, values, provided columns) items.
+        Returns the inserted values, the values of updated books as stored after the update, the rejected rows
+        and the resource_type of the existing books by isbn.
+        """
+        table = Book.__table__
+        isbns = [values['isbn'] for _, values, _ in items]
+        existing = {row.isbn: row.resource_type for row in
+                    con.execute(select([table.c.isbn, table.c.resource_type]).where(table.c.isbn.in_(isbns)))}
+        inserts = [values for _, values, _ in items if values['isbn'] not in existing]
+        rejected = [{'row': number, 'error': f"Book {values['isbn']} already exists!"}
+                    for number, values, _ in items if values['isbn'] in existing and not self.upsert]
+        if len(inserts) > 0:
+            con.execute(table.insert(), inserts)
+        updates = dict()
+        for _, values, provided in items:
+            if values['isbn'] in existing and self.upsert:
+                updates.setdefault(provided - {'isbn'}, []).append(values)
+        for columns, group in updates.items():
+            if len(columns) > 0:
+                con.execute(table.update().where(table.c.isbn == bindparam('_isbn')),
+                            [{'_isbn': values['isbn'], **{column: values[column] for column in columns}}
+                             for values in group])
+        updated = [values['isbn'] for group in updates.values() for values in group]
+        updated = [dict(row) for row in con.execute(table.select().where(table.c.isbn.in_(updated)))] \
+            if len(updated) > 0 else []
+        return inserts, updated, rejected, existing
+
+    def get_report(self, seconds: float) -> dict:
+        return {
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'failed': len(self.errors),
+            'errors': sorted(self.errors, key=lambda error: error['row']),
+            'seconds': round(seconds, 3),
+            'rows_per_second': round((self.inserted + self.updated) / max(seconds, 1e-6)),
+        }
@@ -1,27 +1,44 @@
-from flask import request, Blueprint, Response
+import click
+from flask import request, Blueprint, Response, current_app
 from flask_login import login_required
 from server.config import CustomResponse, InvalidRequestException, RecordNotFoundException
 from server import db
 from server.config import Config
 from sqlalchemy.exc import IntegrityError
 from server.models import Book
+from server.replicas import read_only
+from server.search.engine import catalog_search
+from server.cache.typeahead import typeahead
+from server.serializers import book_relaxed_view
+from server.book.importer import BookImport, import_formats, readers
 
 books = Blueprint('books', __name__, url_prefix='/api/book')
 
 
+def book_changed(book: Book, previous_resource_type: str = None) -> None:
+    catalog_search.book_changed(book, previous_resource_type)
+    typeahead.book_changed(book)
+
+
+def books_changed(changes: list[tuple]) -> None:
+    """Batch of (book, previous resource_type) changes, applied with one update of every index."""
+    catalog_search.books_changed(changes)
+    typeahead.books_changed([book for book, _ in changes])
+
+
 @books.route('/find/<isbn>')
 @login_required
 def find_customer(isbn: str) -> Response:
     res = CustomResponse(data=[])
     try:
-        _books = db.session.query(Book).filter(Book.isbn.like(f"{isbn}%")).limit(10).all()
-        res.set_data(list(map(lambda book: book.get_search_view(), _books)))
+        res.set_data(typeahead.books.find(isbn, limit=10))
     except IntegrityError as e:
         print(str(e))
     return res.get_response()
 
 
 @books.route("/<isbn>")
+@read_only
 @login_required
 def get_book(isbn: str) -> Response:
     res = CustomResponse(data=[])
@@ -29,7 +46,7 @@ def get_book(isbn: str) -> Response:
         book = db.session.query(Book).get(isbn)
         if book is None:
             raise RecordNotFoundException(isbn)
-        res.set_data(book.get_relaxed_view())
+        res.set_data(book_relaxed_view.encode_one(book))
     except RecordNotFoundException as e:
         res.set_error(e.message)
     return res.get_response()
@@ -43,6 +60,7 @@ def create_book() -> Response:
         book = Book(**request.json)
         db.session.add(book)
         db.session.commit()
+        book_changed(book)
         res.set_data(book.get_relaxed_view())
         return res.get_response(201)
     except IntegrityError:
@@ -54,6 +72,49 @@ def create_book() -> Response:
     return res.get_response()
 
 
+@books.route("/import", methods=['PUT'])
+@login_required
+def import_books() -> Response:
+    res = CustomResponse()
+    try:
+        import_format = request.args.get('format')
+        if import_format is None:
+            import_format = next((name for name, mimetype in import_formats.items()
+                                  if mimetype == request.mimetype), None)
+        if import_format not in readers:
+            raise InvalidRequestException(f"Format must be one of {', '.join(readers)}!")
+        batch_size = request.args.get('batch_size', current_app.config['BOOK_IMPORT_BATCH_SIZE'], type=int)
+        if batch_size < 1:
+            raise InvalidRequestException('Batch size must be a positive number!')
+        book_import = BookImport(batch_size=batch_size, upsert=request.args.get('upsert') == 'true',
+                                 books_changed=books_changed)
+        res.set_data(book_import.run(readers[import_format](request.stream)))
+    except InvalidRequestException as e:
+        res.set_error(e.message)
+    return res.get_response()
+
+
+@books.cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'import_format', type=click.Choice(list(readers)), default=None,
+              help='Feed format, guessed from the file extension by default.')
+@click.option('--batch-size', type=int, default=None, help='Rows written per transaction.')
+@click.option('--upsert', is_flag=True, help='Update books with an existing isbn instead of rejecting them.')
+def import_books_command(path: str, import_format: str, batch_size: int, upsert: bool):
+    """Imports books from a CSV or NDJSON feed."""
+    import_format = import_format or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    book_import = BookImport(batch_size=batch_size or current_app.config['BOOK_IMPORT_BATCH_SIZE'], upsert=upsert,
+                             books_changed=books_changed)
+    with open(path, 'rb') as stream:
+        report = book_import.run(readers[import_format](stream))
+    for error in report['errors']:
+        print(f"row {error['row']}: {error['error']}")
+    print(f"inserted: {report['inserted']}, updated: {report['updated']}, failed: {report['failed']}, "
+          f"{report['rows_per_second']} rows/s")
+    if report['failed'] > 0:
+        raise SystemExit(1)
+
+
 @books.route("/<isbn>/update", methods=['POST'])
 @login_required
 def update_book(isbn: str) -> Response:
@@ -62,8 +123,10 @@ def update_book(isbn: str) -> Response:
         book = db.session.query(Book).get(isbn)
         if book is None or book.deleted:
             raise RecordNotFoundException(isbn)
+        previous_resource_type = book.resource_type
         book.update_record(**request.json)
         db.session.commit()
+        book_changed(book, previous_resource_type)
         res.set_data(book.get_relaxed_view())
     except InvalidRequestException or RecordNotFoundException as e:
         db.session.rollback()
@@ -83,8 +146,11 @@ def update_book_stock(isbn: str) -> Response:
         book = db.session.query(Book).get(isbn)
         if book is None or book.deleted:
             raise RecordNotFoundException(isbn)
-        book.update_stock(**request.json)
+        if not Book.set_stock(isbn, **request.json):
+            raise InvalidRequestException('Available copies must stay between 0 and total copies!')
         db.session.commit()
+        db.session.refresh(book)
+        book_changed(book)
         res.set_data(book.get_relaxed_view())
     except InvalidRequestException or RecordNotFoundException as e:
         db.session.rollback()
@@ -105,6 +171,7 @@ def disable_book(isbn: str) -> Response:
             raise RecordNotFoundException(isbn)
         book.disable_record()
         db.session.commit()
+        book_changed(book)
         res.set_data(book.get_relaxed_view())
     except RecordNotFoundException as e:
         db.session.rollback()
@@ -125,6 +192,7 @@ def enable_book(isbn: str) -> Response:
             raise RecordNotFoundException(isbn)
         book.enable_record()
         db.session.commit()
+        book_changed(book)
         res.set_data(book.get_relaxed_view())
     except RecordNotFoundException as e:
         db.session.rollback()
@@ -0,0 +1,95 @@
+from flask import current_app, session
+from flask_login import UserMixin
+from server import db, login_manager
+from server.cache.lru import LRUCache
+from server.models import Customer, Librarian
+
+models = {
+    'customer': Customer,
+    'librarian': Librarian,
+}
+
+
+class Principal(UserMixin):
+    """
+    Lightweight current_user built from the cached identity of a customer or librarian.
+    The ORM instance is loaded only when a handler reads an attribute the principal does not hold itself.
+    """
+
+    def __init__(self, login_type: str, ssn: str, email: str, first_name: str, last_name: str,
+                 is_active: bool = True):
+        self.login_type = login_type
+        self.ssn = ssn
+        self.email = email
+        self.first_name = first_name
+        self.last_name = last_name
+        self._is_active = is_active
+        self._entity = None
+
+    def __repr__(self):
+        return f"Principal({self.login_type} {self.first_name} {self.last_name} ({self.email}))"
+
+    def __getattr__(self, name: str) -> any:
+        if name.startswith('__') or name in ['_entity', '_is_active']:
+            raise AttributeError(name)
+        return getattr(self.entity, name)
+
+    @property
+    def entity(self) -> any:
+        if self._entity is None:
+            self._entity = db.session.query(models[self.login_type]).get(self.ssn)
+        return self._entity
+
+    @property
+    def is_active(self) -> bool:
+        return self._is_active
+
+    def get_id(self) -> str:
+        return self.ssn
+
+
+class IdentityCache:
+    """
+    Flask extension backing the Flask-Login user_loader with an LRU cache of identities keyed by (login_type, ssn),
+    holding IDENTITY_CACHE_SIZE entries for IDENTITY_CACHE_TTL seconds. Handlers changing a customer invalidate it.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.extensions['identity_cache'] = LRUCache(max_size=app.config.get('IDENTITY_CACHE_SIZE', 10000),
+                                                    ttl=app.config.get('IDENTITY_CACHE_TTL', 60))
+
+    @property
+    def cache(self) -> LRUCache:
+        return current_app.extensions['identity_cache']
+
+    def load(self, login_type: str, ssn: str) -> Principal:
+        key = (login_type, ssn)
+        identity = self.cache.get(key)
+        if identity is None:
+            entity = db.session.query(models[login_type]).get(ssn)
+            if entity is None:
+                return None
+            identity = {
+                'ssn': entity.ssn,
+                'email': entity.email,
+                'first_name': entity.first_name,
+                'last_name': entity.last_name,
+                'is_active': entity.is_active,
+            }
+            self.cache.put(key, identity)
+        return Principal(login_type, **identity)
+
+    def invalidate(self, login_type: str, ssn: str) -> None:
+        self.cache.pop((login_type, ssn))
+
+
+identity_cache = IdentityCache()
+
+
+@login_manager.user_loader
+def load_customer(ssn: str) -> any:
+    return identity_cache.load('librarian' if session.get('login_type') == 'librarian' else 'customer', ssn)
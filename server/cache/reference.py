@@ -0,0 +1,70 @@
+from hashlib import sha1
+from threading import Lock
+from time import monotonic
+from flask import Response, current_app, json, request
+from server.config import CustomResponse
+from server.serializers import EncodedData
+
+
+class ReferenceDataEntry:
+
+    def __init__(self, data: EncodedData):
+        self.data = data
+        self.etag = sha1(data.encode('utf-8')).hexdigest()
+        self.loaded_at = monotonic()
+
+
+class ReferenceDataCache:
+    """
+    Flask extension caching serialized lists of slow-changing tables (campuses, library wishlist, ...).
+    Every data set is registered with a loader returning its relaxed views, loaded on first use and kept until
+    it is invalidated or the seconds of its TTL setting pass, REFERENCE_DATA_TTL by default. Invalidation only
+    reaches the current process, data sets users edit get a short TTL so other workers catch up quickly.
+    Responses carry an ETag and answer If-None-Match with 304.
+    """
+
+    def __init__(self, app=None):
+        self.loaders = dict()
+        self.ttl_settings = dict()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.extensions['reference_data'] = {
+            'lock': Lock(),
+            'entries': dict(),
+        }
+
+    def register(self, name: str, ttl_setting: str = 'REFERENCE_DATA_TTL'):
+        def decorator(loader):
+            self.loaders[name] = loader
+            self.ttl_settings[name] = ttl_setting
+            return loader
+
+        return decorator
+
+    @property
+    def _state(self) -> dict:
+        return current_app.extensions['reference_data']
+
+    def get(self, name: str) -> ReferenceDataEntry:
+        state = self._state
+        with state['lock']:
+            entry = state['entries'].get(name)
+            ttl = current_app.config.get(self.ttl_settings[name], 3600)
+            if entry is None or monotonic() - entry.loaded_at > ttl:
+                entry = state['entries'][name] = ReferenceDataEntry(EncodedData(json.dumps(self.loaders[name]())))
+            return entry
+
+    def invalidate(self, name: str) -> None:
+        with self._state['lock']:
+            self._state['entries'].pop(name, None)
+
+    def get_response(self, name: str) -> Response:
+        entry = self.get(name)
+        response = CustomResponse(data=entry.data).get_response()
+        response.set_etag(entry.etag)
+        return response.make_conditional(request)
+
+
+reference_data = ReferenceDataCache()
@@ -0,0 +1,178 @@
+from bisect import bisect_left, insort
+from heapq import merge
+from threading import Event, Lock, Thread
+from flask import current_app
+from sqlalchemy.orm import joinedload
+from server import db
+from server.models import Book, Card, Customer
+
+
+class PrefixIndex:
+    """
+    Sorted keys with their precomputed payloads, answering prefix lookups with bisect.
+    Keys are matched case insensitively like the LIKE lookups they replace, the sorted list holds
+    (casefolded key, key) pairs. The payloads are loaded on the first lookup outside of the lock and refreshed
+    through put and discard afterwards. They are reloaded every TYPEAHEAD_RECONCILE_SECONDS in the background to pick
+    up changes made by other processes or directly in the database, lookups keep using the old payloads meanwhile
+    and changes made meanwhile are applied to the new ones.
+    """
+
+    def __init__(self, loader, name: str):
+        self._loader = loader
+        self._name = name
+        self._lock = Lock()
+        self._build_lock = Lock()
+        self._ready = False
+        self._pending = None
+        self._reconciliation = None
+        self._keys = []
+        self._payloads = dict()
+
+    def load(self, items) -> None:
+        for key, payload in items:
+            self._payloads[key] = payload
+        self._keys = sorted((key.casefold(), key) for key in self._payloads)
+        self._ready = True
+
+    def reload(self) -> None:
+        with self._build_lock:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        """Loads and swaps in new payloads, the caller holds the build lock."""
+        with self._lock:
+            self._pending = []
+        index = PrefixIndex(self._loader, self._name)
+        try:
+            index.load(self._loader())
+        finally:
+            with self._lock:
+                if index._ready:
+                    for key, payload in self._pending:
+                        if payload is None:
+                            index._discard(key)
+                        else:
+                            index._put(key, payload)
+                    self._keys, self._payloads = index._keys, index._payloads
+                    self._ready = True
+                self._pending = None
+
+    def _load(self) -> None:
+        if not self._ready:
+            with self._build_lock:
+                if not self._ready:
+                    self._rebuild()
+                    self._start_reconciliation(current_app._get_current_object())
+
+    def _start_reconciliation(self, app) -> None:
+        interval = app.config.get('TYPEAHEAD_RECONCILE_SECONDS', 900)
+        if interval <= 0 or self._reconciliation is not None:
+            return
+        stopped = self._reconciliation = Event()
+
+        def run():
+            while not stopped.wait(interval):
+                with app.app_context():
+                    try:
+                        self.reload()
+                    except Exception as e:
+                        app.logger.exception(e)
+                    finally:
+                        db.session.remove()
+
+        Thread(target=run, name=f"typeahead-{self._name}-reconciliation", daemon=True).start()
+
+    def _put(self, key: str, payload: dict) -> None:
+        if key not in self._payloads:
+            insort(self._keys, (key.casefold(), key))
+        self._payloads[key] = payload
+
+    def _discard(self, key: str) -> None:
+        if key in self._payloads:
+            del self._payloads[key]
+            del self._keys[bisect_left(self._keys, (key.casefold(), key))]
+
+    def put(self, key: str, payload: dict) -> None:
+        with self._lock:
+            if self._ready:
+                self._put(key, payload)
+            if self._pending is not None:
+                self._pending.append((key, payload))
+
+    def put_many(self, items: list[tuple]) -> None:
+        """Puts (key, payload) items, merging the new keys into the sorted list in one pass."""
+        with self._lock:
+            if self._ready:
+                added = sorted({(key.casefold(), key) for key, _ in items if key not in self._payloads})
+                if len(added) > 0:
+                    self._keys = list(merge(self._keys, added))
+                for key, payload in items:
+                    self._payloads[key] = payload
+            if self._pending is not None:
+                self._pending += items
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            if self._ready:
+                self._discard(key)
+            if self._pending is not None:
+                self._pending.append((key, None))
+
+    def find(self, prefix: str, limit: int = 10) -> list[dict]:
+        self._load()
+        prefix = prefix.casefold()
+        with self._lock:
+            result = []
+            position = bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(result) < limit and self._keys[position][0].startswith(prefix):
+                result.append(self._payloads[self._keys[position][1]])
+                position += 1
+            return result
+
+
+def load_books():
+    for book in db.session.query(Book).yield_per(1000):
+        yield book.isbn, book.get_search_view()
+
+
+def load_cards():
+    for card in db.session.query(Card).options(joinedload(Card.customer).joinedload(Customer.address)):
+        yield card.id, card.get_search_view()
+
+
+class Typeahead:
+    """Flask extension holding the prefix indexes behind the isbn and card id lookups of the circulation desk."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.extensions['typeahead'] = {
+            'books': PrefixIndex(load_books, 'books'),
+            'cards': PrefixIndex(load_cards, 'cards'),
+        }
+
+    @property
+    def books(self) -> PrefixIndex:
+        return current_app.extensions['typeahead']['books']
+
+    @property
+    def cards(self) -> PrefixIndex:
+        return current_app.extensions['typeahead']['cards']
+
+    def book_changed(self, book: Book) -> None:
+        self.books.put(book.isbn, book.get_search_view())
+
+    def books_changed(self, books: list[Book]) -> None:
+        self.books.put_many([(book.isbn, book.get_search_view()) for book in books])
+
+    def card_changed(self, card: Card) -> None:
+        self.cards.put(card.id, card.get_search_view())
+
+    def customer_changed(self, customer: Customer) -> None:
+        for card in customer.cards:
+            self.card_changed(card)
+
+
+typeahead = Typeahead()
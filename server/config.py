@@ -1,6 +1,7 @@
 from dotenv import load_dotenv
 import os
-from flask import Response, json, session
+from flask import Response, json, request, session, stream_with_context
+from server.serializers import EncodedData, Serializer
 
 load_dotenv()
 
@@ -8,11 +9,49 @@ load_dotenv()
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI')
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    }
+    SQLALCHEMY_REPLICA_URIS = [uri.strip() for uri in os.environ.get('SQLALCHEMY_REPLICA_URIS', '').split(',')
+                               if len(uri.strip()) > 0]
+    REPLICA_RETRY_SECONDS = float(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+    REPLICA_READ_AFTER_WRITE_SECONDS = float(os.environ.get('REPLICA_READ_AFTER_WRITE_SECONDS', 5))
+    ASYNC_WORKER_THREADS = int(os.environ.get('ASYNC_WORKER_THREADS', 16))
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    NPLUSONE_THRESHOLD = int(os.environ.get('NPLUSONE_THRESHOLD', 0))
+    NPLUSONE_RAISE = os.environ.get('NPLUSONE_RAISE', 'false').lower() == 'true'
     MAIL_SERVER = 'smtp.googlemail.com'
     MAIL_PORT = 587
     MAIL_USE_TLS = True
     MAIL_USERNAME = os.environ.get('EMAIL_USER')
     MAIL_PASSWORD = os.environ.get('EMAIL_PASS')
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'procedure')
+    SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 1000))
+    SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', 300))
+    SEARCH_INDEX_RECONCILE_SECONDS = float(os.environ.get('SEARCH_INDEX_RECONCILE_SECONDS', 900))
+    SEARCH_FUZZY_THRESHOLD = float(os.environ.get('SEARCH_FUZZY_THRESHOLD', 0.5))
+    SEARCH_FUZZY_BUDGET_MS = float(os.environ.get('SEARCH_FUZZY_BUDGET_MS', 50))
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+    IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', 60))
+    REFERENCE_DATA_TTL = int(os.environ.get('REFERENCE_DATA_TTL', 3600))
+    TYPEAHEAD_RECONCILE_SECONDS = float(os.environ.get('TYPEAHEAD_RECONCILE_SECONDS', 900))
+    LIBRARY_WISHLIST_TTL = float(os.environ.get('LIBRARY_WISHLIST_TTL', 5))
+    PASSWORD_POOL_WORKERS = int(os.environ.get('PASSWORD_POOL_WORKERS', os.cpu_count()))
+    PASSWORD_POOL_MAX_PENDING = int(os.environ.get('PASSWORD_POOL_MAX_PENDING', 0))
+    PASSWORD_POOL_TIMEOUT = float(os.environ.get('PASSWORD_POOL_TIMEOUT', 10))
+    POPULAR_BOOKS_LIMIT = int(os.environ.get('POPULAR_BOOKS_LIMIT', 100))
+    POPULAR_BOOKS_RECONCILE_SECONDS = int(os.environ.get('POPULAR_BOOKS_RECONCILE_SECONDS', 900))
+    LOAN_DURATIONS_RECONCILE_SECONDS = int(os.environ.get('LOAN_DURATIONS_RECONCILE_SECONDS', 900))
+    LOAN_DURATIONS_WARM_UP = os.environ.get('LOAN_DURATIONS_WARM_UP', 'true').lower() == 'true'
+    BOOK_IMPORT_BATCH_SIZE = int(os.environ.get('BOOK_IMPORT_BATCH_SIZE', 1000))
+    LOAN_BATCH_LIMIT = int(os.environ.get('LOAN_BATCH_LIMIT', 100))
+    LOAN_GRACE_PERIOD_DAYS = int(os.environ.get('LOAN_GRACE_PERIOD_DAYS', 28))
     UNHANDLED_EXCEPTION_MESSAGE = os.environ.get('UNHANDLED_EXCEPTION_MESSAGE') \
         if os.environ.get('UNHANDLED_EXCEPTION_MESSAGE') is not None \
         else 'Ups! Unhandled exception occurred.'
@@ -42,6 +81,23 @@ class RecordNotFoundException(Exception):
         self.message = f"Record with value {value} does not exist!" if value is not None else f"Record does not exist!"
 
 
+stream_formats = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def requested_stream_format() -> str:
+    stream_format = request.args.get('stream')
+    return stream_format if stream_format in stream_formats else None
+
+
+class ServiceOverloadedException(Exception):
+
+    def __init__(self, message: str = 'Service is overloaded, try again later!'):
+        self.message = message
+
+
 class CustomResponse:
 
     def __init__(self, data: any = None, error: str = None, librarian_level: bool = False):
@@ -72,5 +128,31 @@ class CustomResponse:
         return f"CustomResponse(ok={self.ok} data={self.data}, error={self.error})"
 
     def get_response(self, status: int = None) -> Response:
-        return Response(json.dumps({"ok": self.ok, "data": self.data, "error": self.error}),
-                        status=status if status is not None else 200 if self.ok else 406, mimetype='application/json')
+        if isinstance(self.data, EncodedData):
+            body = '{"data": ' + self.data + ', "error": null, "ok": true}'
+        else:
+            body = json.dumps({"ok": self.ok, "data": self.data, "error": self.error})
+        return Response(body.encode('utf-8'), status=status if status is not None else 200 if self.ok else 406,
+                        mimetype='application/json')
+
+    def get_streamed_response(self, items, view, stream_format: str = 'json', status: int = None) -> Response:
+        """
+        Serialises items one by one while the response is sent, either as the usual envelope with a chunked
+        data array or as one view per line (ndjson), so memory does not grow with the number of items.
+        The view is either a method building the dict view or a Serializer.
+        """
+        encode = view.encode if isinstance(view, Serializer) else lambda item: json.dumps(view(item))
+
+        def generate_json():
+            yield '{"data": ['
+            for index, item in enumerate(items):
+                yield (', ' if index > 0 else '') + encode(item)
+            yield '], "error": null, "ok": true}'
+
+        def generate_ndjson():
+            for item in items:
+                yield encode(item) + '\n'
+
+        generate = generate_ndjson if stream_format == 'ndjson' else generate_json
+        return Response(stream_with_context(generate()), status=status if status is not None else 200,
+                        mimetype=stream_formats[stream_format])
@@ -1,9 +1,17 @@
 from datetime import datetime, timedelta
 from flask import Blueprint, request, Response
-from server import db, bcrypt
+from server import db
 from sqlalchemy.exc import IntegrityError
-from server.config import CustomResponse, RecordNotFoundException, InvalidRequestException, Config
+from sqlalchemy.orm import joinedload
+from server.config import CustomResponse, RecordNotFoundException, InvalidRequestException, Config, \
+    ServiceOverloadedException
+from server.passwords import password_pool
 from server.models import Customer, Card, PhoneNumber, Address, Loan
+from server.cache.typeahead import typeahead
+from server.loaders import customer_relaxed_view
+from server.cache.identity import identity_cache
+from server.serializers import loan_relaxed_view
+from server.replicas import read_only
 
 customers = Blueprint('customers', __name__, url_prefix='/api/customer')
 
@@ -12,8 +20,7 @@ customers = Blueprint('customers', __name__, url_prefix='/api/customer')
 def find_customer(card_id: str) -> Response:
     res = CustomResponse(data=[])
     try:
-        cards = db.session.query(Card).filter(Card.id.like(f"{card_id}%")).limit(10).all()
-        res.set_data(list(map(lambda card: card.get_search_view(), cards)))
+        res.set_data(typeahead.cards.find(card_id, limit=10))
     except IntegrityError as e:
         res.set_error(Config.UNHANDLED_EXCEPTION_MESSAGE)
         # print(str(e))
@@ -21,10 +28,11 @@ def find_customer(card_id: str) -> Response:
 
 
 @customers.route('/<ssn>')
+@read_only
 def get_customer(ssn: str) -> Response:
     res = CustomResponse(data=[])
     try:
-        customer = db.session.query(Customer).get(ssn)
+        customer = customer_relaxed_view.get(ssn)
         if customer is None:
             raise RecordNotFoundException(ssn)
         res.set_data(customer.get_relaxed_view())
@@ -37,7 +45,7 @@ def get_customer(ssn: str) -> Response:
 def create_new_customer() -> Response:
     res = CustomResponse()
     try:
-        pw_hash = bcrypt.generate_password_hash(password=Customer.generate_password())
+        pw_hash = password_pool.generate_password_hash(Customer.generate_password())
         phone_numbers = request.json.get('phone_numbers')
         phone_numbers = list(
             map(lambda number: PhoneNumber(customer_ssn=request.json.get('ssn'), **number), phone_numbers))
@@ -52,7 +60,8 @@ def create_new_customer() -> Response:
         customer = Customer(**request.json, cards=cards, address=address, phone_numbers=phone_numbers, pw_hash=pw_hash)
         db.session.add(customer)
         db.session.commit()
-        res.set_data(customer.get_relaxed_view())
+        typeahead.customer_changed(customer)
+        res.set_data(customer_relaxed_view.get(customer.ssn).get_relaxed_view())
         return res.get_response(201)
     except IntegrityError as e:
         db.session.rollback()
@@ -61,6 +70,10 @@ def create_new_customer() -> Response:
     except InvalidRequestException as e:
         db.session.rollback()
         res.set_error(e.message)
+    except ServiceOverloadedException as e:
+        db.session.rollback()
+        res.set_error(e.message)
+        return res.get_response(503)
     return res.get_response()
 
 
@@ -74,7 +87,9 @@ def update_customer(ssn: str) -> Response:
                 raise RecordNotFoundException()
             customer.update_record(**request.json)
             db.session.commit()
-            res.set_data(customer.get_relaxed_view())
+            identity_cache.invalidate('customer', ssn)
+            typeahead.customer_changed(customer)
+            res.set_data(customer_relaxed_view.get(ssn).get_relaxed_view())
     except InvalidRequestException or RecordNotFoundException as e:
         db.session.rollback()
         res.set_error(e.message)
@@ -94,7 +109,8 @@ def disable_customer(ssn: str) -> Response:
             raise RecordNotFoundException()
         customer.disable_record()
         db.session.commit()
-        res.set_data(customer.get_relaxed_view())
+        identity_cache.invalidate('customer', ssn)
+        res.set_data(customer_relaxed_view.get(ssn).get_relaxed_view())
     except InvalidRequestException or RecordNotFoundException as e:
         db.session.rollback()
         res.set_error(e.message)
@@ -113,7 +129,8 @@ def enable_customer(ssn: str) -> Response:
             raise RecordNotFoundException()
         customer.enable_record()
         db.session.commit()
-        res.set_data(customer.get_relaxed_view())
+        identity_cache.invalidate('customer', ssn)
+        res.set_data(customer_relaxed_view.get(ssn).get_relaxed_view())
     except InvalidRequestException or RecordNotFoundException as e:
         db.session.rollback()
         res.set_error(e.message)
@@ -124,11 +141,13 @@ def enable_customer(ssn: str) -> Response:
 
 
 @customers.route('/<ssn>/rentals/active')
+@read_only
 def fetch_customers_active_rentals(ssn: str) -> Response:
     res = CustomResponse(data=[])
     try:
-        active_loans = db.session.query(Loan).filter(Loan.customer_ssn == ssn, Loan.returned_at == None).order_by(Loan.loaned_at.desc()).all()
-        res.set_data(list(map(lambda loan: loan.get_relaxed_view(), active_loans)))
+        active_loans = db.session.query(Loan).options(joinedload(Loan.book)) \
+            .filter(Loan.customer_ssn == ssn, Loan.returned_at == None).order_by(Loan.loaned_at.desc()).all()
+        res.set_data(loan_relaxed_view.encode_many(active_loans))
     except IntegrityError as e:
         res.set_error(Config.UNHANDLED_EXCEPTION_MESSAGE)
         # print(str(e))
@@ -144,7 +163,8 @@ def extend_customers_card_validity(id: str) -> Response:
             raise RecordNotFoundException(id)
         card.extend_validity()
         db.session.commit()
-        res.set_data(card.customer.get_relaxed_view())
+        typeahead.card_changed(card)
+        res.set_data(customer_relaxed_view.get(card.customer_ssn).get_relaxed_view())
     except RecordNotFoundException as e:
         db.session.rollback()
         res.set_error(e.message)
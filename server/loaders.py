@@ -0,0 +1,45 @@
+from sqlalchemy.orm import joinedload, selectinload
+from server import db
+from server.models import Campus, Customer, CustomerWishlistItem, Librarian
+
+
+class ViewLoader:
+    """
+    Loads instances of a model together with every relationship one of its views touches,
+    so rendering the view costs a fixed number of queries instead of one lazy load per relationship and item.
+    """
+
+    def __init__(self, model, *options):
+        self.model = model
+        self.options = options
+
+    def query(self):
+        return db.session.query(self.model).options(*self.options).populate_existing()
+
+    def get(self, ident: any) -> any:
+        return self.query().get(ident)
+
+    def first(self, *criterion) -> any:
+        return self.query().filter(*criterion).first()
+
+
+customer_relaxed_view = ViewLoader(
+    Customer,
+    selectinload(Customer.cards),
+    joinedload(Customer.campus).joinedload(Campus.address),
+    joinedload(Customer.address),
+    selectinload(Customer.phone_numbers),
+    selectinload(Customer.wishlist_items).joinedload(CustomerWishlistItem.book),
+)
+
+customer_relaxed_v1_view = ViewLoader(
+    Customer,
+    joinedload(Customer.campus).joinedload(Campus.address),
+    joinedload(Customer.address),
+    selectinload(Customer.phone_numbers),
+)
+
+librarian_relaxed_view = ViewLoader(
+    Librarian,
+    joinedload(Librarian.campus_address).joinedload(Campus.address),
+)
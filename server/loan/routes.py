@@ -1,16 +1,50 @@
 from datetime import datetime
-from flask import request, Blueprint, Response
+from uuid import UUID
+from flask import request, Blueprint, Response, current_app
 from flask_login import login_required, current_user
 from server.config import CustomResponse, InvalidRequestException, RecordNotFoundException
 from server import db
 from server.config import Config
-from sqlalchemy.sql import text
-from sqlalchemy.exc import IntegrityError
-from server.models import Loan, Book
+from sqlalchemy.exc import IntegrityError, DBAPIError
+from server.models import Loan, Book, Customer
+from server.serializers import book_relaxed_view
+from server.v1.popularity import popular_books
+from server.v1.loan_duration import loan_days, loan_durations
+from server.procedures import insert_loan, insert_loans, return_copies
+from server.search.engine import catalog_search
 
 loans = Blueprint('loans', __name__, url_prefix='/api/loan')
 
 
+def get_batch(key: str) -> list:
+    items = request.json.get(key) if isinstance(request.json, dict) else None
+    if not isinstance(items, list) or len(items) == 0:
+        raise InvalidRequestException(f"Field {key} must be a non empty list!")
+    if len(items) > current_app.config['LOAN_BATCH_LIMIT']:
+        raise InvalidRequestException(f"At most {current_app.config['LOAN_BATCH_LIMIT']} items fit in one batch!")
+    return items
+
+
+def get_closed_loans(closed: list[Loan]) -> tuple[list, set]:
+    """
+    The (days, customer type, subject area) of the closed loans for loan_durations and the resource types of their
+    books, with one query before the commit, which would expire the loans and lazy-load customer and book of each.
+    """
+    if len(closed) == 0:
+        return [], set()
+    details = {id: (type, subject_area, resource_type) for id, type, subject_area, resource_type in
+               db.session.query(Loan.id, Customer.type, Book.subject_area, Book.resource_type)
+               .join(Customer, Customer.ssn == Loan.customer_ssn)
+               .join(Book, Book.isbn == Loan.book_isbn)
+               .filter(Loan.id.in_([loan.id for loan in closed]))}
+    durations = [(loan_days(loan.loaned_at, loan.returned_at), *details[loan.id][:2]) for loan in closed]
+    return durations, {resource_type for _, _, resource_type in details.values()}
+
+
+def get_item_result(data: any = None, error: str = None) -> dict:
+    return {'data': data, 'error': error, 'ok': error is None}
+
+
 @loans.route("/start", methods=['PUT'])
 @login_required
 def start_loan() -> Response:
@@ -18,23 +52,15 @@ def start_loan() -> Response:
     try:
         if request.json['ssn'] is None or request.json['isbn'] is None:
             raise InvalidRequestException
-        request.json['issued_by'] = current_user.ssn
-        request.json['loaned_at'] = datetime.now()
-        request.json['returned_at'] = None
-        statement = text(f"""
-            exec insertLoan
-            @book_isbn = :isbn,
-            @customer_ssn = :ssn,
-            @issued_by = :issued_by,
-            @loaned_at = :loaned_at,
-            @returned_at = :returned_at
-        """)
-        db.session.execute(statement, request.json)
+        insert_loan(db.session.connection(), isbn=request.json['isbn'], ssn=request.json['ssn'],
+                    issued_by=current_user.ssn, loaned_at=datetime.now())
         db.session.commit()
 
         book = db.session.query(Book).get(request.json['isbn'])
-        res.set_data(book.get_relaxed_view())
-    except RecordNotFoundException or InvalidRequestException as e:
+        popular_books.loan_started(book)
+        catalog_search.stock_changed({book.resource_type})
+        res.set_data(book_relaxed_view.encode_one(book))
+    except (RecordNotFoundException, InvalidRequestException) as e:
         db.session.rollback()
         res.set_error(e.message)
     except IntegrityError:
@@ -48,12 +74,115 @@ def start_loan() -> Response:
 def close_loan(id: str) -> Response:
     res = CustomResponse()
     try:
-        loan = db.session.query(Loan).get(id)
+        loan = db.session.query(Loan).get(str(id))
         if loan is None:
             raise RecordNotFoundException(id)
         loan.close()
+        durations, resource_types = get_closed_loans([loan])
+        return_copies(db.session.connection(), [loan])
+        db.session.commit()
+        loan_durations.loans_closed(durations)
+        catalog_search.stock_changed(resource_types)
+    except (RecordNotFoundException, InvalidRequestException) as e:
+        db.session.rollback()
+        res.set_error(e.message)
+    except IntegrityError:
+        db.session.rollback()
+        res.set_error(Config.UNHANDLED_EXCEPTION_MESSAGE)
+    return res.get_response()
+
+
+@loans.route("/start/batch", methods=['PUT'])
+@login_required
+def start_loans() -> Response:
+    """
+    Starts every loan of the batch in one transaction with set based statements of insert_loans. When one of them
+    fails, the batch is undone and every loan is started in a savepoint of its own instead, so a rejected item
+    does not undo the others. Results follow the order of the items.
+    """
+    res = CustomResponse()
+    try:
+        items = get_batch('loans')
+        errors = dict()
+        valid = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or item.get('ssn') is None or item.get('isbn') is None:
+                errors[index] = InvalidRequestException().message
+            else:
+                valid.append(index)
+        loaned_at = datetime.now()
+        try:
+            with db.session.begin_nested():
+                insert_loans(db.session.connection(), [items[index] for index in valid], issued_by=current_user.ssn,
+                             loaned_at=loaned_at)
+            started = valid
+        except (InvalidRequestException, DBAPIError):
+            started = []
+            for index in valid:
+                try:
+                    with db.session.begin_nested():
+                        insert_loan(db.session.connection(), isbn=items[index]['isbn'], ssn=items[index]['ssn'],
+                                    issued_by=current_user.ssn, loaned_at=loaned_at)
+                    started.append(index)
+                except (RecordNotFoundException, InvalidRequestException) as e:
+                    errors[index] = e.message
+                except DBAPIError:
+                    errors[index] = Config.UNHANDLED_EXCEPTION_MESSAGE
+        db.session.commit()
+
+        isbns = {items[index]['isbn'] for index in started}
+        books = {book.isbn: book for book in db.session.query(Book).filter(Book.isbn.in_(isbns))} \
+            if len(isbns) > 0 else dict()
+        for index in started:
+            popular_books.loan_started(books[items[index]['isbn']])
+        catalog_search.stock_changed({book.resource_type for book in books.values()})
+        res.set_data([get_item_result(error=errors[index]) if index in errors
+                      else get_item_result(books[item['isbn']].get_relaxed_view())
+                      for index, item in enumerate(items)])
+    except InvalidRequestException as e:
+        db.session.rollback()
+        res.set_error(e.message)
+    except IntegrityError:
+        db.session.rollback()
+        res.set_error(Config.UNHANDLED_EXCEPTION_MESSAGE)
+    return res.get_response()
+
+
+@loans.route("/close/batch", methods=['POST'])
+@login_required
+def close_loans() -> Response:
+    """
+    Closes every loan of the batch with one query and one commit, results follow the order of the ids.
+    A loan which is closed already is reported as a failed item.
+    """
+    res = CustomResponse()
+    try:
+        ids = []
+        for id in get_batch('ids'):
+            try:
+                ids.append(str(UUID(str(id))))
+            except ValueError:
+                ids.append(None)
+        found = {loan.id.lower(): loan for loan in
+                 db.session.query(Loan).filter(Loan.id.in_([id for id in ids if id is not None]))}
+        errors = dict()
+        closed = []
+        for id, loan in found.items():
+            try:
+                loan.close()
+                closed.append(loan)
+            except InvalidRequestException as e:
+                errors[id] = e.message
+        durations, resource_types = get_closed_loans(closed)
+        return_copies(db.session.connection(), closed)
         db.session.commit()
-    except RecordNotFoundException as e:
+
+        loan_durations.loans_closed(durations)
+        catalog_search.stock_changed(resource_types)
+        res.set_data([get_item_result(error=errors.get(id)) if id in found else
+                      get_item_result(error=RecordNotFoundException(id or raw).message)
+                      for id, raw in zip(ids, request.json['ids'])])
+    except InvalidRequestException as e:
         db.session.rollback()
         res.set_error(e.message)
     except IntegrityError:
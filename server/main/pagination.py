@@ -0,0 +1,52 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodingError
+from datetime import datetime
+from sqlalchemy import or_
+from server.config import InvalidRequestException
+from server.procedures import not_returned_loans, select_all
+
+overdue_page_size = 25
+
+
+def encode_cursor(grace_period_end: datetime, id: str) -> str:
+    return urlsafe_b64encode(json.dumps([str(grace_period_end), str(id)]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        grace_period_end, id = json.loads(urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(grace_period_end), id
+    except (DecodingError, UnicodeError, TypeError, ValueError):
+        raise InvalidRequestException('Invalid cursor!')
+
+
+def overdue_loans_query(view, *criteria):
+    return select_all(view) \
+        .where(*criteria, view.c.grace_period_end < datetime.now()) \
+        .order_by(view.c.grace_period_end.desc(), view.c.id.desc())
+
+
+def fetch_overdue_loans_page(con, cursor: str = None, view=None) -> dict:
+    """
+    Keyset pagination over not_returned_loans ordered by (grace_period_end, id) descending.
+    The page starts right after the row encoded in the cursor, so rows returned in the meantime do not shift the
+    following pages. The cost does not depend on the depth as long as the database has an index to seek on
+    (grace_period_end, id) of loans not returned, see the README.
+    """
+    view = view if view is not None else not_returned_loans(con)
+    criteria = []
+    if cursor is not None:
+        grace_period_end, id = decode_cursor(cursor)
+        criteria = [view.c.grace_period_end <= grace_period_end,
+                    or_(view.c.grace_period_end < grace_period_end, view.c.id < id)]
+    statement = overdue_loans_query(view, *criteria).limit(overdue_page_size + 1)
+    rows = [dict(row._mapping) for row in con.execute(statement)]
+    next_cursor = None
+    if len(rows) > overdue_page_size:
+        rows = rows[:overdue_page_size]
+        next_cursor = encode_cursor(rows[-1]['grace_period_end'], rows[-1]['id'])
+    return {
+        'loans': rows,
+        'next_cursor': next_cursor,
+    }
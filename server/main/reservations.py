@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+from server import db
+from server.main.pagination import encode_cursor, decode_cursor
+from server.models import CustomerWishlistItem
+
+reservations_page_size = 50
+reservation_window = timedelta(days=30)
+
+
+def open_reservations():
+    """
+    Reservations requested within the reservation window and not picked up yet, oldest first.
+    The criteria follow the (picked_up, requested_at) index, books and customers are loaded in the same query.
+    """
+    return db.session.query(CustomerWishlistItem) \
+        .options(joinedload(CustomerWishlistItem.book), joinedload(CustomerWishlistItem.customer)) \
+        .filter(CustomerWishlistItem.picked_up == False,
+                CustomerWishlistItem.requested_at > datetime.now() - reservation_window) \
+        .order_by(CustomerWishlistItem.requested_at, CustomerWishlistItem.id)
+
+
+def get_open_reservation(id: str) -> CustomerWishlistItem:
+    return open_reservations().filter(CustomerWishlistItem.id == id).first()
+
+
+def fetch_reservations_page(cursor: str = None) -> dict:
+    """Keyset pagination over the open reservations, the cursor encodes the last (requested_at, id) returned."""
+    reservations = open_reservations()
+    if cursor is not None:
+        requested_at, id = decode_cursor(cursor)
+        reservations = reservations.filter(CustomerWishlistItem.requested_at >= requested_at,
+                                           or_(CustomerWishlistItem.requested_at > requested_at,
+                                               CustomerWishlistItem.id > id))
+    items = reservations.limit(reservations_page_size + 1).all()
+    next_cursor = None
+    if len(items) > reservations_page_size:
+        items = items[:reservations_page_size]
+        next_cursor = encode_cursor(items[-1].requested_at, items[-1].id)
+    return {
+        'reservations': [item.get_librarian_relaxed_view() for item in items],
+        'next_cursor': next_cursor,
+    }
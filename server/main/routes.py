@@ -1,12 +1,19 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from flask import request, session, Blueprint, Response
-from sqlalchemy.sql import text
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 from flask_login import login_required, current_user, login_user, logout_user
 from server.config import CustomResponse, Config, InvalidRequestException, RecordNotFoundException, \
-    UnauthorizedAccessException
-from server import db, bcrypt
+    UnauthorizedAccessException, ServiceOverloadedException, requested_stream_format
+from server import db
+from server.passwords import password_pool
 from server.models import Campus, LibrarianWishlistItem, Librarian, CustomerWishlistItem
+from server.main.pagination import fetch_overdue_loans_page, overdue_page_size
+from server.procedures import not_returned_loans, select_all
+from server.main.reservations import open_reservations, get_open_reservation, fetch_reservations_page
+from server.loaders import librarian_relaxed_view
+from server.cache.reference import reference_data
+from server.replicas import read_only
 
 main = Blueprint('main', __name__, url_prefix='/api/library')
 main_unsecure = Blueprint('main_unsecure', __name__, url_prefix='/library')
@@ -29,13 +36,17 @@ def login() -> Response:
     if current_user.is_authenticated:
         res.set_data(current_user.get_relaxed_view())
         return res.get_response()
-    librarian = db.session.query(Librarian).filter(Librarian.email == request.json.get('email')).first()
-    if librarian and bcrypt.check_password_hash(librarian.password, request.json.get('password')):
-        login_user(librarian)
-        session['login_type'] = 'librarian'
-        res.set_data(librarian.get_relaxed_view())
-    else:
-        res.set_error('Wrong email or password!')
+    librarian = librarian_relaxed_view.first(Librarian.email == request.json.get('email'))
+    try:
+        if librarian and password_pool.check_password_hash(librarian.password, request.json.get('password')):
+            login_user(librarian)
+            session['login_type'] = 'librarian'
+            res.set_data(librarian.get_relaxed_view())
+        else:
+            res.set_error('Wrong email or password!')
+    except ServiceOverloadedException as e:
+        res.set_error(e.message)
+        return res.get_response(503)
     return res.get_response()
 
 
@@ -53,13 +64,26 @@ def logout() -> Response:
     return res.get_response()
 
 
+@reference_data.register('library_wishlist', ttl_setting='LIBRARY_WISHLIST_TTL')
+def load_library_wishlist() -> list[dict]:
+    return list(map(lambda item: item.get_relaxed_view(), db.session.query(LibrarianWishlistItem).all()))
+
+
+@reference_data.register('campuses')
+def load_campuses() -> list[dict]:
+    campuses = db.session.query(Campus).options(joinedload(Campus.address)).all()
+    return list(map(lambda campus: campus.get_relaxed_view(), campuses))
+
+
 @main.route('/wishlist')
 @login_required
 def fetch_library_wishlist() -> Response:
     res = CustomResponse()
-    library_wishlist = db.session.query(LibrarianWishlistItem).all()
-    res.set_data(list(map(lambda item: item.get_relaxed_view(), library_wishlist)))
-    return res.get_response()
+    stream_format = requested_stream_format()
+    if stream_format is not None:
+        return res.get_streamed_response(db.session.query(LibrarianWishlistItem).yield_per(500),
+                                         LibrarianWishlistItem.get_relaxed_view, stream_format)
+    return reference_data.get_response('library_wishlist')
 
 
 @main.route('/wishlist/add', methods=['PUT'])
@@ -70,6 +94,7 @@ def add_item_to_library_wishlist() -> Response:
         item = LibrarianWishlistItem(**request.json)
         db.session.add(item)
         db.session.commit()
+        reference_data.invalidate('library_wishlist')
         res.set_data(item.get_relaxed_view())
     except InvalidRequestException as e:
         db.session.rollback()
@@ -90,6 +115,7 @@ def remove_item_from_library_wishlist(id: str) -> Response:
             raise RecordNotFoundException(id)
         db.session.delete(item)
         db.session.commit()
+        reference_data.invalidate('library_wishlist')
         res.set_data({'id': id})
     except RecordNotFoundException as e:
         db.session.rollback()
@@ -104,11 +130,23 @@ def remove_item_from_library_wishlist(id: str) -> Response:
 @login_required
 def fetch_library_reservations() -> Response:
     res = CustomResponse()
-    library_reservations = db.session.query(CustomerWishlistItem) \
-        .filter(CustomerWishlistItem.requested_at is not None,
-                CustomerWishlistItem.requested_at > (datetime.now() - timedelta(days=30)),
-                CustomerWishlistItem.picked_up == 0).all()
-    res.set_data(list(map(lambda item: item.get_librarian_relaxed_view(), library_reservations)))
+    library_reservations = open_reservations()
+    stream_format = requested_stream_format()
+    if stream_format is not None:
+        return res.get_streamed_response(library_reservations.yield_per(500),
+                                         CustomerWishlistItem.get_librarian_relaxed_view, stream_format)
+    res.set_data(list(map(lambda item: item.get_librarian_relaxed_view(), library_reservations.all())))
+    return res.get_response()
+
+
+@main.route('/reservations/queue')
+@login_required
+def fetch_library_reservations_after_cursor() -> Response:
+    res = CustomResponse()
+    try:
+        res.set_data(fetch_reservations_page(request.args.get('cursor')))
+    except InvalidRequestException as e:
+        res.set_error(e.message)
     return res.get_response()
 
 
@@ -117,8 +155,8 @@ def fetch_library_reservations() -> Response:
 def accept_library_reservation(id: str) -> Response:
     res = CustomResponse()
     try:
-        item = db.session.query(CustomerWishlistItem).get(id)
-        if item is None or item.id not in list(map(lambda it: it['id'], fetch_library_reservations().json['data'])):
+        item = get_open_reservation(str(id))
+        if item is None:
             raise RecordNotFoundException(id)
         # TODO: mark item as accepted
         db.session.commit()
@@ -130,32 +168,40 @@ def accept_library_reservation(id: str) -> Response:
 
 
 @main.route('/loans/overdue/<int:page>')
+@read_only
 @login_required
 def fetch_overdue_loans(page: int) -> Response:
     res = CustomResponse()
-    with db.engine.connect() as con:
-        statement = text(f"""
-        select * 
-        from not_returned_loans
-        where grace_period_end < getdate()
-        order by grace_period_end desc
-        OFFSET :page * 25 ROWS
-        FETCH NEXT 25 ROW ONLY;
-         """)
-        rs = con.execute(statement, {'page': page})
-        data = []
-        for row in rs:
-            row_val = dict()
-            for column, value in row.items():
-                row_val[column] = value
-            data.append(row_val)
+    con = db.session.connection()
+    view = not_returned_loans(con)
+    statement = select_all(view) \
+        .where(view.c.grace_period_end < datetime.now()) \
+        .order_by(view.c.grace_period_end.desc()) \
+        .offset(page * overdue_page_size) \
+        .limit(overdue_page_size)
+    rs = con.execute(statement)
+    data = []
+    for row in rs:
+        row_val = dict()
+        for column, value in row._mapping.items():
+            row_val[column] = value
+        data.append(row_val)
     res.set_data(data)
     return res.get_response()
 
 
-@main_unsecure.route('/static/campuses')
-def fetch_campuses() -> Response:
+@main.route('/loans/overdue')
+@read_only
+@login_required
+def fetch_overdue_loans_after_cursor() -> Response:
     res = CustomResponse()
-    campuses = db.session.query(Campus).all()
-    res.set_data(list(map(lambda campus: campus.get_relaxed_view(), campuses)))
+    try:
+        res.set_data(fetch_overdue_loans_page(db.session.connection(), request.args.get('cursor')))
+    except InvalidRequestException as e:
+        res.set_error(e.message)
     return res.get_response()
+
+
+@main_unsecure.route('/static/campuses')
+def fetch_campuses() -> Response:
+    return reference_data.get_response('campuses')
@@ -1,14 +1,14 @@
-from flask import current_app, session
+from flask import current_app
 from datetime import datetime, timedelta
 from flask_login import UserMixin
 from itsdangerous import Serializer
 from sqlalchemy import Table, Column, String, Text, Integer, Boolean, ForeignKey, SmallInteger, DateTime, Date, \
-    FetchedValue
+    FetchedValue, Index, UniqueConstraint, bindparam, literal
 from sqlalchemy.orm import relationship, declarative_base
 from server.config import InvalidRequestException
 from string import ascii_letters, digits
 from random import choice, randint
-from server import db, login_manager, bcrypt
+from server import db, bcrypt
 
 Base = declarative_base()
 
@@ -92,16 +92,71 @@ class Book(Base):
 
         return self.get_relaxed_view()
 
-    def update_stock(self, total_copies: int = None, available_copies: int = None, **other: dict) -> dict:
-        if len(other) > 0:
-            raise InvalidRequestException
+    @staticmethod
+    def _execute_many(con, statement, parameters: list[dict]) -> int:
+        """Executes the statement with executemany and returns the rows matched by all parameter sets."""
+        if con.dialect.supports_sane_multi_rowcount:
+            return con.execute(statement, parameters).rowcount
+        return sum(con.execute(statement, values).rowcount for values in parameters)
 
-        if total_copies is not None:
-            self.total_copies = total_copies
-        if available_copies is not None:
-            self.available_copies = available_copies
+    @staticmethod
+    def take_copies(counts: dict, con=None) -> bool:
+        """
+        Takes the given number of copies of every isbn of counts, each with a single conditional UPDATE, so
+        concurrent callers can never take more copies than there are. Returns False when a book is not active and
+        loanable or lacks copies, the caller owns the transaction and rolls it back.
+        """
+        book = Book.__table__
+        statement = book.update() \
+            .where(book.c.isbn == bindparam('_isbn'), book.c.deleted == False, book.c.is_loanable == True,
+                   book.c.available_copies >= bindparam('_count')) \
+            .values(available_copies=book.c.available_copies - bindparam('_count'))
+        taken = Book._execute_many(con if con is not None else db.session.connection(), statement,
+                                   [{'_isbn': isbn, '_count': count} for isbn, count in counts.items()])
+        return taken == len(counts)
 
-        return self.get_relaxed_view()
+    @staticmethod
+    def take_copy(isbn: str, con=None) -> bool:
+        """Takes one available copy of an active book, returns False when no copy is left."""
+        return Book.take_copies({isbn: 1}, con)
+
+    @staticmethod
+    def return_copies(isbns: list[str], con=None) -> int:
+        """
+        Puts one copy back per isbn of the list, repeated isbns included, unless all copies are available already.
+        The counterpart of take_copies, returns the number of copies put back.
+        """
+        book = Book.__table__
+        statement = book.update() \
+            .where(book.c.isbn == bindparam('_isbn'), book.c.available_copies < book.c.total_copies) \
+            .values(available_copies=book.c.available_copies + 1)
+        return Book._execute_many(con if con is not None else db.session.connection(), statement,
+                                  [{'_isbn': isbn} for isbn in isbns])
+
+    @staticmethod
+    def return_copy(isbn: str, con=None) -> bool:
+        """Puts one copy back unless all copies are available already, the counterpart of take_copy."""
+        return Book.return_copies([isbn], con) == 1
+
+    @staticmethod
+    def set_stock(isbn: str, total_copies: int = None, available_copies: int = None, **other: dict) -> bool:
+        """
+        Changes the stock with a single UPDATE. A new total shifts the available copies by the same difference
+        computed in the database, so loans started meanwhile are not lost, unless available_copies is given as well.
+        Returns False when the book does not exist or the result would leave negative or more than total copies.
+        """
+        if len(other) > 0 or any(not isinstance(value, int) or value < 0
+                                 for value in [total_copies, available_copies] if value is not None):
+            raise InvalidRequestException
+
+        book = Book.__table__
+        total = book.c.total_copies if total_copies is None else literal(total_copies)
+        available = literal(available_copies) if available_copies is not None \
+            else book.c.available_copies + (total - book.c.total_copies)
+        rs = db.session.execute(book.update()
+                                .where(book.c.isbn == isbn, available >= 0, available <= total)
+                                .values(total_copies=total, available_copies=available))
+        return rs.rowcount == 1
 
     def disable_record(self) -> None:
         self.deleted = True
@@ -404,15 +459,6 @@ class Customer(Base, UserMixin):
         self.is_active = True
 
 
-@login_manager.user_loader
-def load_customer(ssn: str) -> any:
-    login_type = session.get('login_type')
-    if login_type == 'librarian':
-        return db.session.query(Librarian).get(ssn)
-    else:
-        return db.session.query(Customer).get(ssn)
-
-
 class CustomerWishlistItem(Base):
     __table__ = Table(
         'customer_wishlist_item',
@@ -422,6 +468,8 @@ class CustomerWishlistItem(Base):
         Column('book_isbn', String, ForeignKey('book.isbn'), nullable=False),
         Column('requested_at', DateTime),
         Column('picked_up', Boolean, default=False, nullable=False),
+        Index('ix_customer_wishlist_item_picked_up_requested_at', 'picked_up', 'requested_at'),
+        UniqueConstraint('customer_ssn', 'book_isbn', name='uq_customer_wishlist_item_customer_ssn_book_isbn'),
     )
 
     customer = relationship('Customer', lazy=True)
@@ -595,4 +643,6 @@ class Loan(Base):
         }
 
     def close(self):
+        if self.returned_at is not None:
+            raise InvalidRequestException(f"Loan {self.id} is closed already!")
         self.returned_at = datetime.now()
@@ -0,0 +1,200 @@
+from bisect import bisect_left
+from hmac import compare_digest
+from threading import Lock, current_thread, local
+from time import perf_counter
+from flask import Response, current_app, g, request
+from werkzeug.local import Local
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from server.cache.lru import LRUCache
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+cache_counters = (
+    ('cache_hits_total', 'Lookups served by the in-process caches.', 'hits'),
+    ('cache_misses_total', 'Lookups the in-process caches could not serve, including expired entries.', 'misses'),
+    ('cache_evictions_total', 'Entries dropped by the in-process caches to stay within their size.', 'evictions'),
+)
+
+
+class _Shard:
+    """Counters written by a single thread only, so recording needs no lock."""
+
+    def __init__(self):
+        self.requests = dict()
+        self.latencies = dict()
+        self.statements = dict()
+        self.sql_seconds = dict()
+
+    def merge(self, shard: '_Shard') -> None:
+        for key, count in list(shard.requests.items()):
+            self.requests[key] = self.requests.get(key, 0) + count
+        for endpoint, histogram in list(shard.latencies.items()):
+            merged = self.latencies.setdefault(endpoint, [0] * (len(latency_buckets) + 1) + [0.0])
+            for index, value in enumerate(list(histogram)):
+                merged[index] += value
+        for endpoint, count in list(shard.statements.items()):
+            self.statements[endpoint] = self.statements.get(endpoint, 0) + count
+        for endpoint, seconds in list(shard.sql_seconds.items()):
+            self.sql_seconds[endpoint] = self.sql_seconds.get(endpoint, 0.0) + seconds
+
+
+class _Recording:
+    """SQL statements and time of the request being served by the thread."""
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.started = None
+
+
+def escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """
+    Flask extension recording per endpoint request counts by status code, latency histograms and the number and
+    time of SQL statements, exposed in the Prometheus text format at /metrics. The endpoint is open to anyone who
+    reaches the server unless METRICS_TOKEN is set, then it requires an Authorization: Bearer <token> header.
+    Every thread aggregates into a shard of its own, shards are only merged when /metrics is scraped. The shards of
+    finished threads are folded into one retired shard, so servers starting a thread per request do not pile them up.
+    SQL statements are counted by engine events on behalf of the request served by the executing thread.
+    """
+
+    def __init__(self, app=None):
+        self._lock = Lock()
+        self._shards = []
+        self._retired = _Shard()
+        self._local = local()
+        self._requests = Local()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        if not app.config.get('METRICS_ENABLED', True):
+            return
+        app.extensions['metrics'] = self
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.get_response)
+        with self._lock:
+            if not self._listening:
+                event.listen(Engine, 'before_cursor_execute', self._start_statement)
+                event.listen(Engine, 'after_cursor_execute', self._finish_statement)
+                self._listening = True
+
+    def _get_shard(self) -> _Shard:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._retire()
+                self._shards.append((current_thread(), shard))
+        return shard
+
+    def _retire(self) -> None:
+        """Folds the shards of finished threads into the retired shard, the caller holds the lock."""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._retired.merge(shard)
+        self._shards = alive
+
+    def _start_request(self) -> None:
+        recording = self._requests.recording = _Recording()
+        g.metrics_started = perf_counter()
+        g.metrics_recording = recording
+
+    def _finish_request(self, response: Response) -> Response:
+        started = g.pop('metrics_started', None)
+        recording = g.pop('metrics_recording', None)
+        self._requests.recording = None
+        if started is None:
+            return response
+        elapsed = perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        shard = self._get_shard()
+        key = (endpoint, request.method, response.status_code)
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        histogram = shard.latencies.get(endpoint)
+        if histogram is None:
+            histogram = shard.latencies[endpoint] = [0] * (len(latency_buckets) + 1) + [0.0]
+        histogram[bisect_left(latency_buckets, elapsed)] += 1
+        histogram[-1] += elapsed
+        shard.statements[endpoint] = shard.statements.get(endpoint, 0) + recording.statements
+        shard.sql_seconds[endpoint] = shard.sql_seconds.get(endpoint, 0.0) + recording.sql_seconds
+        return response
+
+    def _start_statement(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        recording = getattr(self._requests, 'recording', None)
+        if recording is not None:
+            recording.started = perf_counter()
+
+    def _finish_statement(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        recording = getattr(self._requests, 'recording', None)
+        if recording is not None and recording.started is not None:
+            recording.statements += 1
+            recording.sql_seconds += perf_counter() - recording.started
+            recording.started = None
+
+    def collect(self) -> _Shard:
+        """Merges the shards of all threads, including the ones that finished already."""
+        total = _Shard()
+        with self._lock:
+            self._retire()
+            total.merge(self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            total.merge(shard)
+        return total
+
+    def render(self) -> str:
+        total = self.collect()
+        lines = ['# HELP http_requests_total Requests served by endpoint, method and status code.',
+                 '# TYPE http_requests_total counter']
+        for (endpoint, method, status), count in sorted(total.requests.items()):
+            lines.append(f'http_requests_total{{endpoint="{escape(endpoint)}",method="{method}",'
+                         f'status="{status}"}} {count}')
+        lines += ['# HELP http_request_duration_seconds Request latency by endpoint.',
+                  '# TYPE http_request_duration_seconds histogram']
+        for endpoint, histogram in sorted(total.latencies.items()):
+            label = f'endpoint="{escape(endpoint)}"'
+            cumulative = 0
+            for bound, count in zip(latency_buckets, histogram):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            count = cumulative + histogram[len(latency_buckets)]
+            lines.append(f'http_request_duration_seconds_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f'http_request_duration_seconds_sum{{{label}}} {histogram[-1]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{{label}}} {count}')
+        lines += ['# HELP sql_statements_total SQL statements executed while serving requests, by endpoint.',
+                  '# TYPE sql_statements_total counter']
+        for endpoint, count in sorted(total.statements.items()):
+            lines.append(f'sql_statements_total{{endpoint="{escape(endpoint)}"}} {count}')
+        lines += ['# HELP sql_duration_seconds_total Time spent executing SQL while serving requests, by endpoint.',
+                  '# TYPE sql_duration_seconds_total counter']
+        for endpoint, seconds in sorted(total.sql_seconds.items()):
+            lines.append(f'sql_duration_seconds_total{{endpoint="{escape(endpoint)}"}} {seconds:.6f}')
+        caches = sorted((name, cache) for name, cache in current_app.extensions.items() if isinstance(cache, LRUCache))
+        for metric, help_text, attribute in cache_counters:
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+            for name, cache in caches:
+                lines.append(f'{metric}{{cache="{escape(name)}"}} {getattr(cache, attribute)}')
+        lines += ['# HELP cache_entries Entries held by the in-process caches.', '# TYPE cache_entries gauge']
+        for name, cache in caches:
+            lines.append(f'cache_entries{{cache="{escape(name)}"}} {len(cache)}')
+        return '\n'.join(lines) + '\n'
+
+    def get_response(self) -> Response:
+        token = current_app.config.get('METRICS_TOKEN')
+        if token and not compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+            return Response('Unauthorized\n', status=401, mimetype=None, content_type=content_type,
+                            headers={'WWW-Authenticate': 'Bearer'})
+        return Response(self.render(), mimetype=None, content_type=content_type)
+
+
+metrics = Metrics()
@@ -0,0 +1,78 @@
+from threading import Lock
+from time import perf_counter
+from flask import current_app
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError
+from server import db
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool measuring how long checkouts wait for a connection, including opening new ones."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            with self._wait_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = perf_counter() - started
+            with self._wait_lock:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+class PoolMetrics:
+    """
+    Flask extension exposing the state of the connection pool of the application engine.
+    Engines configured with a pool_size get a TimedQueuePool, so checkout wait times are reported as well.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+        if 'pool_size' in options and 'poolclass' not in options:
+            # a copy, the dict may be shared with the Config class and every other application created from it
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**options, 'poolclass': TimedQueuePool}
+
+    def get_view(self) -> dict:
+        pool = db.get_engine(current_app).pool
+        view = {
+            'pool': type(pool).__name__,
+            'status': pool.status(),
+        }
+        if isinstance(pool, QueuePool):
+            view.update({
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'idle': pool.checkedin(),
+                'overflow': max(pool.overflow(), 0),
+                'max_overflow': pool._max_overflow,
+                'timeout_seconds': pool.timeout(),
+            })
+        if isinstance(pool, TimedQueuePool):
+            with pool._wait_lock:
+                view['waits'] = {
+                    'count': pool.waits,
+                    'average_ms': round(pool.wait_seconds / pool.waits * 1000, 3) if pool.waits > 0 else None,
+                    'max_ms': round(pool.max_wait_seconds * 1000, 3),
+                    'timeouts': pool.timeouts,
+                }
+        return view
+
+
+pool_metrics = PoolMetrics()
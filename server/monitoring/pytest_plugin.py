@@ -0,0 +1,35 @@
+"""
+Pytest fixture for declaring the query budget of endpoints, enabled in a conftest.py with
+
+    pytest_plugins = ['server.monitoring.pytest_plugin']
+
+and used in tests as
+
+    def test_history(client, query_budget):
+        with query_budget(queries=3):
+            client.get('/api/user/history')
+
+The test fails when the block executes more statements than budgeted, or any statement shape more than
+repeats times, which catches N+1 regressions of lazy relationships. With NPLUSONE_RAISE set, the reports of the
+NPlusOneDetector for the requests served in the block are raised as NPlusOneException when it is left.
+"""
+from contextlib import contextmanager
+import pytest
+from server.monitoring.queries import QueryRecorder, describe_repeats
+
+
+@pytest.fixture
+def query_budget():
+
+    @contextmanager
+    def budget(queries: int = None, repeats: int = 1):
+        with QueryRecorder() as recorder:
+            yield recorder
+        if queries is not None and len(recorder.statements) > queries:
+            pytest.fail(f"{len(recorder.statements)} statements executed, the budget is {queries}:\n"
+                        + '\n'.join(recorder.statements), pytrace=False)
+        found = recorder.get_repeats(repeats)
+        if len(found) > 0:
+            pytest.fail(f"Statements repeated more than {repeats} times: {describe_repeats(found)}", pytrace=False)
+
+    return budget
@@ -0,0 +1,133 @@
+import re
+import warnings
+from collections import Counter
+from threading import Lock
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.local import Local
+
+literal_pattern = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+placeholders_pattern = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+whitespace_pattern = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """The statement with literals replaced by placeholders and IN lists collapsed, equal for every N+1 query."""
+    shape = literal_pattern.sub('?', statement)
+    shape = re.sub(r'%\(\w+\)s|:\w+|%s', '?', shape)
+    shape = placeholders_pattern.sub('(?)', shape)
+    return whitespace_pattern.sub(' ', shape).strip()
+
+
+class NPlusOneWarning(UserWarning):
+    pass
+
+
+class NPlusOneException(Exception):
+
+    def __init__(self, message: str):
+        self.message = message
+
+
+class QueryRecorder:
+    """
+    Records the statements executed by the current thread, or greenlet, while it is active, usable as a context
+    manager. N+1 reports of requests served inside the block are raised as NPlusOneException when it is left.
+    """
+
+    _local = Local()
+    _lock = Lock()
+    _listening = False
+
+    def __init__(self):
+        self.statements = []
+        self.reports = []
+
+    @classmethod
+    def _listen(cls) -> None:
+        with cls._lock:
+            if not cls._listening:
+                event.listen(Engine, 'before_cursor_execute', cls._record)
+                cls._listening = True
+
+    @classmethod
+    def _record(cls, conn, cursor, statement, parameters, context, executemany) -> None:
+        for recorder in getattr(cls._local, 'active', ()):
+            recorder.statements.append(statement)
+
+    def start(self) -> 'QueryRecorder':
+        self._listen()
+        if not hasattr(self._local, 'active'):
+            self._local.active = []
+        self._local.active.append(self)
+        return self
+
+    def stop(self) -> None:
+        active = getattr(self._local, 'active', [])
+        if self in active:
+            active.remove(self)
+
+    def __enter__(self) -> 'QueryRecorder':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+        if exc_type is None and len(self.reports) > 0:
+            raise NPlusOneException('\n'.join(self.reports))
+
+    @classmethod
+    def report(cls, message: str) -> bool:
+        """Hands the report to the active recorders of the current thread, returns whether there was one."""
+        active = getattr(cls._local, 'active', [])
+        for recorder in active:
+            recorder.reports.append(message)
+        return len(active) > 0
+
+    def get_repeats(self, threshold: int) -> dict:
+        """Statement shapes executed more than threshold times."""
+        counts = Counter(statement_shape(statement) for statement in self.statements)
+        return {shape: count for shape, count in counts.most_common() if count > threshold}
+
+
+def describe_repeats(repeats: dict) -> str:
+    return '; '.join(f"{count}x {shape[:200]}" for shape, count in repeats.items())
+
+
+class NPlusOneDetector:
+    """
+    Flask extension recording the statements of every request and reporting statement shapes repeated more than
+    NPLUSONE_THRESHOLD times, the signature of lazy relationships loaded in a loop. Reports are logged and emitted
+    as NPlusOneWarning. With NPLUSONE_RAISE set they are instead raised as NPlusOneException by the QueryRecorder
+    blocks the request was served in, such as query_budget of the pytest plugin, once the response is complete,
+    so the hooks never turn a served response into an error. The recorder is stopped on teardown, so it also stops
+    after requests failing with an exception, which are reported as well. A threshold of 0 disables it.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        if app.config.get('NPLUSONE_THRESHOLD', 0) <= 0:
+            return
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+
+    def _start_request(self) -> None:
+        g.nplusone_recorder = QueryRecorder().start()
+
+    def _finish_request(self, exception: BaseException = None) -> None:
+        recorder = g.pop('nplusone_recorder', None)
+        if recorder is None:
+            return
+        recorder.stop()
+        repeats = recorder.get_repeats(current_app.config['NPLUSONE_THRESHOLD'])
+        if len(repeats) > 0:
+            message = f"Repeated statements in {request.method} {request.path}: {describe_repeats(repeats)}"
+            current_app.logger.warning(message)
+            if not current_app.config.get('NPLUSONE_RAISE', False) or not QueryRecorder.report(message):
+                warnings.warn(message, NPlusOneWarning)
+
+
+nplusone_detector = NPlusOneDetector()
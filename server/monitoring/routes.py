@@ -0,0 +1,33 @@
+from flask import Blueprint, Response, current_app
+from flask_login import login_required
+from server.config import CustomResponse, UnauthorizedAccessException
+from server.monitoring.pool import pool_metrics
+
+monitoring = Blueprint('monitoring', __name__, url_prefix='/api/internal')
+
+
+@monitoring.route('/pool')
+@login_required
+def fetch_pool_metrics() -> Response:
+    try:
+        res = CustomResponse(librarian_level=True)
+    except UnauthorizedAccessException as e:
+        res = CustomResponse()
+        res.set_error(e.message)
+        return res.get_response(status=401)
+    res.set_data(pool_metrics.get_view())
+    return res.get_response()
+
+
+@monitoring.route('/replicas')
+@login_required
+def fetch_replica_health() -> Response:
+    try:
+        res = CustomResponse(librarian_level=True)
+    except UnauthorizedAccessException as e:
+        res = CustomResponse()
+        res.set_error(e.message)
+        return res.get_response(status=401)
+    replicas = current_app.extensions.get('replicas')
+    res.set_data(replicas.get_view() if replicas is not None else None)
+    return res.get_response()
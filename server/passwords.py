@@ -0,0 +1,110 @@
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from hmac import compare_digest
+from threading import BoundedSemaphore, Lock
+import bcrypt
+from flask import current_app
+from server.config import ServiceOverloadedException
+
+
+def hash_password(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def check_password(pw_hash: bytes, password: bytes) -> bool:
+    return compare_digest(bcrypt.hashpw(password, pw_hash), pw_hash)
+
+
+def to_bytes(value: any) -> bytes:
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+class PasswordPool:
+    """
+    Flask extension running bcrypt hashing and verification in a bounded process pool, so a burst of logins
+    does not pin every request worker. At most PASSWORD_POOL_MAX_PENDING calls wait for the
+    PASSWORD_POOL_WORKERS processes, any call above that fails fast with ServiceOverloadedException.
+    With PASSWORD_POOL_WORKERS = 0 the work runs inline in the calling thread.
+    A call keeps its slot until its job completes, also when the caller gave up waiting after PASSWORD_POOL_TIMEOUT.
+    A pool broken by a dead worker process is replaced and the call retried once.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        workers = app.config.get('PASSWORD_POOL_WORKERS', os.cpu_count())
+        app.extensions['password_pool'] = {
+            'workers': workers,
+            'rounds': app.config.get('BCRYPT_LOG_ROUNDS', 12),
+            'timeout': app.config.get('PASSWORD_POOL_TIMEOUT', 10),
+            'slots': BoundedSemaphore(app.config.get('PASSWORD_POOL_MAX_PENDING') or max(1, workers) * 4),
+            'lock': Lock(),
+            'executor': None,
+        }
+
+    @property
+    def _state(self) -> dict:
+        return current_app.extensions['password_pool']
+
+    def _executor(self, state: dict) -> ProcessPoolExecutor:
+        with state['lock']:
+            if state['executor'] is None:
+                state['executor'] = ProcessPoolExecutor(max_workers=state['workers'])
+            return state['executor']
+
+    @staticmethod
+    def _discard(state: dict, executor: ProcessPoolExecutor) -> None:
+        with state['lock']:
+            if state['executor'] is executor:
+                state['executor'] = None
+        executor.shutdown(wait=False)
+
+    def _submit(self, state: dict, function, args: tuple) -> tuple[ProcessPoolExecutor, Future]:
+        executor = self._executor(state)
+        try:
+            return executor, executor.submit(function, *args)
+        except BrokenProcessPool:
+            self._discard(state, executor)
+            executor = self._executor(state)
+            return executor, executor.submit(function, *args)
+
+    def _run(self, function, *args, retry: bool = True) -> any:
+        state = self._state
+        if not state['slots'].acquire(blocking=False):
+            raise ServiceOverloadedException
+        if state['workers'] == 0:
+            try:
+                return function(*args)
+            finally:
+                state['slots'].release()
+        try:
+            executor, future = self._submit(state, function, args)
+        except BaseException:
+            state['slots'].release()
+            raise
+        future.add_done_callback(lambda _: state['slots'].release())
+        try:
+            return future.result(timeout=state['timeout'])
+        except FutureTimeoutError:
+            future.cancel()
+            raise ServiceOverloadedException
+        except BrokenProcessPool:
+            self._discard(state, executor)
+            if not retry:
+                raise ServiceOverloadedException
+        return self._run(function, *args, retry=False)
+
+    def generate_password_hash(self, password: str) -> bytes:
+        return self._run(hash_password, to_bytes(password), self._state['rounds'])
+
+    def check_password_hash(self, pw_hash: any, password: str) -> bool:
+        if pw_hash is None or password is None:
+            return False
+        return self._run(check_password, to_bytes(pw_hash), to_bytes(password))
+
+
+password_pool = PasswordPool()
@@ -0,0 +1,198 @@
+"""
+Stored procedures and views of the MSSQL database, each with a portable SQLAlchemy Core stand-in picked by the
+dialect of the connection, so the application runs against SQLite in development and benchmarks.
+The stand-ins follow what the application expects from the database objects, not their exact MSSQL bodies.
+"""
+from collections import Counter
+from datetime import timedelta
+from uuid import uuid4
+from flask import current_app
+from sqlalchemy import DateTime, String, event, func, literal_column, or_, select, type_coerce
+from sqlalchemy.sql import column, table, text
+from server.config import InvalidRequestException
+from server.models import Book, Card, CustomerWishlistItem, LibrarianWishlistItem, Loan
+from server.v1.loan_duration import loan_days
+
+search_columns = {
+    'TITLE': 'title',
+    'AUTHOR': 'author',
+    'AREA': 'subject_area',
+}
+
+not_returned_loans_view = table(
+    'not_returned_loans',
+    column('id', String),
+    column('grace_period_end', DateTime),
+)
+
+
+def is_mssql(con) -> bool:
+    return con.dialect.name == 'mssql'
+
+
+def assign_id(mapper, con, target) -> None:
+    """Stand-in for the newid() default of the id columns, which other databases do not have."""
+    if target.id is None and not is_mssql(con):
+        target.id = str(uuid4())
+
+
+for model in [Card, CustomerWishlistItem, LibrarianWishlistItem, Loan]:
+    event.listen(model, 'before_insert', assign_id)
+
+
+def find_book(con, phrase: str, columns: list[str], group: str, offset: int, limit: int) -> list:
+    """
+    Rows of active books of the group with the phrase in any of the columns, ordered by title.
+    The phrase is bound as a parameter of find_book, the stand-in matches it case insensitively anywhere in the column.
+    """
+    if is_mssql(con):
+        statement = text("""
+            exec find_book
+            @order_by = 'title',
+            @offset = :offset,
+            @limit = :limit,
+            @search_group = :group,
+            @title = :title,
+            @author = :author,
+            @area = :area;
+        """)
+        return con.execute(statement, {
+            'offset': offset,
+            'limit': limit,
+            'group': group,
+            'title': phrase if 'TITLE' in columns else None,
+            'author': phrase if 'AUTHOR' in columns else None,
+            'area': phrase if 'AREA' in columns else None,
+        }).fetchall()
+
+    book = Book.__table__
+    pattern = f"%{phrase.lower()}%"
+    statement = select(book) \
+        .where(book.c.deleted == False,
+               or_(*[func.lower(book.c[search_columns[name]]).like(pattern) for name in columns])) \
+        .order_by(book.c.title, book.c.isbn) \
+        .offset(offset) \
+        .limit(limit)
+    if group != 'EVERYTHING':
+        statement = statement.where(book.c.resource_type == group)
+    return con.execute(statement).fetchall()
+
+
+def insert_loan(con, isbn: str, ssn: str, issued_by: str, loaned_at, returned_at=None) -> None:
+    """
+    Starts a loan of one copy of the book. The stand-in takes the copy with Book.take_copy and raises
+    InvalidRequestException when no copy is available.
+    """
+    if is_mssql(con):
+        con.execute(text("""
+            exec insertLoan
+            @book_isbn = :isbn,
+            @customer_ssn = :ssn,
+            @issued_by = :issued_by,
+            @loaned_at = :loaned_at,
+            @returned_at = :returned_at
+        """), {'isbn': isbn, 'ssn': ssn, 'issued_by': issued_by, 'loaned_at': loaned_at, 'returned_at': returned_at})
+        return
+
+    if not Book.take_copy(isbn, con):
+        raise InvalidRequestException('No copy of the book is available for a loan!')
+    con.execute(Loan.__table__.insert().values(id=str(uuid4()), book_isbn=isbn, customer_ssn=ssn,
+                                               issued_by=issued_by, loaned_at=loaned_at, returned_at=returned_at))
+
+
+def insert_loans(con, loans: list[dict], issued_by: str, loaned_at) -> None:
+    """
+    Starts the loans of (isbn, ssn) items at once, insertLoan executed with executemany on MSSQL. The stand-in takes
+    the copies of every book with Book.take_copies and inserts the loans with one executemany. Raises
+    InvalidRequestException when a book lacks copies for all of its loans, without telling which one, the caller
+    undoes the batch and retries the items one by one.
+    """
+    if len(loans) == 0:
+        return
+    if is_mssql(con):
+        con.execute(text("""
+            exec insertLoan
+            @book_isbn = :isbn,
+            @customer_ssn = :ssn,
+            @issued_by = :issued_by,
+            @loaned_at = :loaned_at,
+            @returned_at = NULL
+        """), [{'isbn': loan['isbn'], 'ssn': loan['ssn'], 'issued_by': issued_by, 'loaned_at': loaned_at}
+               for loan in loans])
+        return
+
+    if not Book.take_copies(Counter(loan['isbn'] for loan in loans), con):
+        raise InvalidRequestException('No copy of the book is available for a loan!')
+    con.execute(Loan.__table__.insert(), [{'id': str(uuid4()), 'book_isbn': loan['isbn'], 'customer_ssn': loan['ssn'],
+                                           'issued_by': issued_by, 'loaned_at': loaned_at, 'returned_at': None}
+                                          for loan in loans])
+
+
+def return_copies(con, loans: list[Loan]) -> None:
+    """
+    Gives the copies of the closed loans back. On MSSQL the stock is left to the database as before, the stand-in
+    puts one copy back per loan with Book.return_copies.
+    """
+    if is_mssql(con) or len(loans) == 0:
+        return
+    Book.return_copies([loan.book_isbn for loan in loans], con)
+
+
+def fetch_top_x_popular_books(con, count: int) -> list:
+    """
+    Rows of the count most loaned books, most loaned first. The stand-in returns isbn, title, author and loan_count
+    like the /v1/statistics/books/popular endpoint, which serves them from the PopularBooks leaderboard instead.
+    """
+    if is_mssql(con):
+        return con.execute(text("exec fetch_top_x_popular_books @limit = :count;"), {'count': count}).all()
+
+    loan, book = Loan.__table__, Book.__table__
+    loan_count = func.count(loan.c.id).label('loan_count')
+    return con.execute(select(book.c.isbn, book.c.title, book.c.author, loan_count)
+                       .select_from(loan.join(book, book.c.isbn == loan.c.book_isbn))
+                       .group_by(book.c.isbn, book.c.title, book.c.author)
+                       .order_by(loan_count.desc(), book.c.isbn)
+                       .limit(count)).all()
+
+
+def get_average_loan_time_in_days(con) -> float:
+    """Average number of days between the start and the return of closed loans, None without any."""
+    if is_mssql(con):
+        return con.execute(text("exec get_average_loan_time_in_days;")).first()['average_loan_length_in_days']
+
+    loan = Loan.__table__
+    total = count = 0
+    for loaned_at, returned_at in con.execute(select(loan.c.loaned_at, loan.c.returned_at)
+                                              .where(loan.c.returned_at != None)):
+        total += loan_days(loaned_at, returned_at)
+        count += 1
+    return round(total / count, 2) if count > 0 else None
+
+
+def not_returned_loans(con):
+    """
+    The not_returned_loans view, or a subquery with the columns of the loan plus grace_period_end,
+    LOAN_GRACE_PERIOD_DAYS after the loan started, for loans not returned yet.
+    """
+    if is_mssql(con):
+        return not_returned_loans_view
+
+    loan = Loan.__table__
+    grace_period = current_app.config.get('LOAN_GRACE_PERIOD_DAYS', 28)
+    if con.dialect.name == 'sqlite':
+        # keeps the fraction of seconds, so the values compare with bound datetimes like any other DateTime column
+        grace_period_end = func.strftime('%Y-%m-%d %H:%M:%S', loan.c.loaned_at, f"+{grace_period} days") \
+            .concat(func.substr(loan.c.loaned_at, 20))
+    else:
+        grace_period_end = loan.c.loaned_at + timedelta(days=grace_period)
+    return select(loan.c.id, loan.c.book_isbn, loan.c.customer_ssn, loan.c.issued_by, loan.c.loaned_at,
+                  type_coerce(grace_period_end, DateTime).label('grace_period_end')) \
+        .where(loan.c.returned_at == None) \
+        .subquery('not_returned_loans')
+
+
+def select_all(view):
+    """Selects every column of the view, including the ones the declaration of the MSSQL view leaves out."""
+    if view is not_returned_loans_view:
+        return select(literal_column('*')).select_from(view)
+    return select(view)
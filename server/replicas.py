@@ -0,0 +1,184 @@
+"""
+Routing of read-only requests to replicas of the database. Statements of views marked with read_only run on one of
+the SQLALCHEMY_REPLICA_URIS engines, picked round robin among the reachable ones. Every other request stays on the
+primary, and so does a read-only request from the moment its session flushes or executes an insert, update or delete.
+A client whose request wrote reads from the primary for REPLICA_READ_AFTER_WRITE_SECONDS afterwards, so it sees its
+own changes before the replicas catch up with them.
+
+A replica is marked unreachable when its engine fails to connect or loses a connection. It is skipped for
+REPLICA_RETRY_SECONDS, the requests falling back to the next replica, or to the primary when none is left, and
+probed with a connection checkout by the first pick after that. Apart from the very first pick, which probes
+every replica once, reachable replicas are picked without a probe.
+"""
+from threading import Lock
+from time import monotonic, time
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.dml import UpdateBase
+
+fence_key = 'replica_fence'
+
+
+def read_only(view):
+    """Marks a view which does not write, its statements may run on a replica."""
+    view.read_only = True
+    return view
+
+
+def reads_from_replica() -> bool:
+    if not has_request_context() or g.get('database_written', False):
+        return False
+    if not getattr(current_app.view_functions.get(request.endpoint), 'read_only', False):
+        return False
+    return session.get(fence_key, 0) <= time()
+
+
+class Replica:
+
+    def __init__(self, engine, retry_seconds: float, logger):
+        self.engine = engine
+        self.retry_seconds = retry_seconds
+        self.logger = logger
+        self.retry_at = None
+        self.probed = False
+        self.picks = 0
+        self.failures = 0
+        self.error = None
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def is_available(self) -> bool:
+        return self.retry_at is None or self.retry_at <= monotonic()
+
+    def probe(self) -> bool:
+        failures = self.failures
+        try:
+            with self.engine.connect():
+                pass
+        except DBAPIError as e:
+            if self.failures == failures:
+                self.mark_down(e)
+            return False
+        if self.retry_at is not None:
+            self.logger.info(f"Replica {self.engine.url!r} is reachable again.")
+            self.retry_at = None
+            self.error = None
+        self.probed = True
+        return True
+
+    def mark_down(self, error: Exception) -> None:
+        self.failures += 1
+        self.error = str(getattr(error, 'orig', error))
+        self.retry_at = monotonic() + self.retry_seconds
+        self.logger.warning(f"Replica {self.engine.url!r} is unreachable, retrying in {self.retry_seconds}s: "
+                            f"{self.error}")
+
+    def _handle_error(self, context) -> None:
+        # without a connection the engine failed to open one
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.original_exception)
+
+    def get_view(self) -> dict:
+        return {
+            'url': repr(self.engine.url),
+            'available': self.retry_at is None,
+            'retry_in_seconds': round(max(self.retry_at - monotonic(), 0), 3) if self.retry_at is not None else None,
+            'picks': self.picks,
+            'failures': self.failures,
+            'error': self.error,
+        }
+
+
+class ReplicaPool:
+
+    def __init__(self, replicas: list[Replica], read_after_write_seconds: float):
+        self.replicas = replicas
+        self.read_after_write_seconds = read_after_write_seconds
+        self._lock = Lock()
+        self._next = 0
+
+    def pick(self):
+        """Engine of the next reachable replica, None when there is none. Only replicas marked down are probed."""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        for index in range(len(self.replicas)):
+            replica = self.replicas[(start + index) % len(self.replicas)]
+            if (replica.probed and replica.retry_at is None) or (replica.is_available() and replica.probe()):
+                replica.picks += 1
+                return replica.engine
+        return None
+
+    def get_view(self) -> dict:
+        return {
+            'read_after_write_seconds': self.read_after_write_seconds,
+            'replicas': [replica.get_view() for replica in self.replicas],
+        }
+
+
+class RoutingSession(SignallingSession):
+    """
+    SignallingSession sending the statements of read-only requests to a replica, the one picked first for the
+    whole session. Sessions bound to a connection explicitly are not routed.
+    """
+
+    def __init__(self, db, autocommit=False, autoflush=True, **options):
+        self._routed = options.get('bind') is None
+        self._replica = None
+        super().__init__(db, autocommit=autocommit, autoflush=autoflush, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            if has_request_context():
+                g.database_written = True
+        elif self._routed and reads_from_replica():
+            replicas = self.app.extensions.get('replicas')
+            if replicas is not None:
+                if self._replica is None:
+                    self._replica = replicas.pick() or False
+                if self._replica is not False:
+                    return self._replica
+        return super().get_bind(mapper, clause)
+
+    def commit(self):
+        if has_request_context() and not reads_from_replica():
+            g.database_written = True
+        super().commit()
+
+    def close(self):
+        super().close()
+        self._replica = None
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension creating RoutingSessions and the engines of SQLALCHEMY_REPLICA_URIS."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        super().init_app(app)
+        uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+        if len(uris) == 0:
+            return
+        retry_seconds = app.config.get('REPLICA_RETRY_SECONDS', 30)
+        replicas = [Replica(self.create_replica_engine(app, uri), retry_seconds, app.logger) for uri in uris]
+        app.extensions['replicas'] = ReplicaPool(replicas, app.config.get('REPLICA_READ_AFTER_WRITE_SECONDS', 5))
+        app.after_request(self._fence)
+
+    def create_replica_engine(self, app, uri: str):
+        """Engine with the options the primary engine gets."""
+        options = self.apply_pool_defaults(app, {})
+        sa_url, options = self.apply_driver_hacks(app, make_url(uri), options)
+        options.update(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        options.update(self._engine_options)
+        return self.create_engine(sa_url, options)
+
+    @staticmethod
+    def _fence(response):
+        seconds = current_app.extensions['replicas'].read_after_write_seconds
+        if g.get('database_written', False) and seconds > 0:
+            session[fence_key] = time() + seconds
+        return response
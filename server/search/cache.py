@@ -0,0 +1,38 @@
+from server.cache.lru import LRUCache
+
+
+class SearchResultCache(LRUCache):
+    """
+    LRU cache of serialized search result pages keyed by the normalized SearchRequest.
+    A change of a book drops the pages of its resource_type and of EVERYTHING. Every group carries a generation
+    bumped by each invalidation, a page computed while its group was invalidated is not stored, so it cannot
+    outlive the change. Other worker processes keep their pages for at most ttl seconds.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60):
+        super().__init__(max_size, ttl)
+        self.invalidations = 0
+        self._generations = dict()
+
+    @staticmethod
+    def get_key(req) -> tuple:
+        return req.mode, req.phrase.casefold(), tuple(sorted(req.columns)), req.group, req.offset, req.limit
+
+    def get_generation(self, group: str) -> int:
+        return self._generations.get(group, 0)
+
+    def put_page(self, key: tuple, page: str, generation: int) -> None:
+        with self._lock:
+            if self._generations.get(key[3], 0) == generation:
+                self._put(key, page)
+
+    def invalidate(self, resource_types: set) -> int:
+        groups = set(resource_types) | {'EVERYTHING'}
+        with self._lock:
+            for group in groups:
+                self._generations[group] = self._generations.get(group, 0) + 1
+            keys = [key for key in self._entries if key[3] in groups]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+            return len(keys)
@@ -0,0 +1,342 @@
+from bisect import bisect_left, insort
+from heapq import nsmallest
+from threading import Event, Lock, Thread
+from flask import current_app, json
+from server import db
+from server.models import Book
+from server.procedures import find_book
+from server.search.cache import SearchResultCache
+from server.search.fuzzy import FuzzySearch
+from server.search.text import tokenize
+from server.serializers import EncodedData
+
+column_attributes = {
+    'TITLE': 'title',
+    'AUTHOR': 'author',
+    'AREA': 'subject_area',
+}
+
+
+class SearchBackend:
+    """Base class of the catalog search backends selected by SEARCH_BACKEND."""
+
+    def search(self, req) -> list[dict]:
+        raise NotImplementedError
+
+    def warm_up(self) -> None:
+        """Builds what the backend would otherwise build on the first search."""
+        pass
+
+    def book_changed(self, book: Book) -> None:
+        pass
+
+    def books_changed(self, books: list[Book]) -> None:
+        for book in books:
+            self.book_changed(book)
+
+
+class ProcedureSearchBackend(SearchBackend):
+    """Delegates every search to the find_book stored procedure, or its stand-in outside of MSSQL."""
+
+    def search(self, req) -> list[dict]:
+        rows = find_book(db.session.connection(), req.phrase, req.columns, req.group, req.offset, req.limit)
+        return [Book(**row._mapping).get_relaxed_view() for row in rows]
+
+
+class _Partition:
+    """Postings of all active books sharing one resource_type."""
+
+    def __init__(self):
+        self.postings = {column: dict() for column in column_attributes.values()}
+        self.vocabulary = {column: [] for column in column_attributes.values()}
+
+    def add(self, isbn: str, tokens: dict, keep_sorted: bool = True) -> None:
+        for column, column_tokens in tokens.items():
+            postings = self.postings[column]
+            for token in column_tokens:
+                if token not in postings:
+                    postings[token] = set()
+                    if keep_sorted:
+                        insort(self.vocabulary[column], token)
+                    else:
+                        self.vocabulary[column].append(token)
+                postings[token].add(isbn)
+
+    def sort(self) -> None:
+        """Sorts the tokens added with keep_sorted off into the vocabularies, a merge of two runs when they are few."""
+        for vocabulary in self.vocabulary.values():
+            vocabulary.sort()
+
+    def remove(self, isbn: str, tokens: dict) -> None:
+        for column, column_tokens in tokens.items():
+            postings = self.postings[column]
+            for token in column_tokens:
+                isbns = postings.get(token)
+                if isbns is None:
+                    continue
+                isbns.discard(isbn)
+                if len(isbns) == 0:
+                    del postings[token]
+                    vocabulary = self.vocabulary[column]
+                    del vocabulary[bisect_left(vocabulary, token)]
+
+    def match_prefix(self, column: str, prefix: str) -> set:
+        vocabulary = self.vocabulary[column]
+        postings = self.postings[column]
+        result = set()
+        position = bisect_left(vocabulary, prefix)
+        while position < len(vocabulary) and vocabulary[position].startswith(prefix):
+            result |= postings[vocabulary[position]]
+            position += 1
+        return result
+
+    def match(self, column: str, phrase_tokens: list[str]) -> set:
+        result = None
+        for token in phrase_tokens:
+            matches = self.match_prefix(column, token)
+            result = matches if result is None else result & matches
+            if len(result) == 0:
+                break
+        return result if result is not None else set()
+
+
+class InvertedIndexSearchBackend(SearchBackend):
+    """
+    In-memory inverted index over title, author and subject area of all active books, partitioned by resource_type.
+    Every phrase token has to prefix-match a token of the same column, results are ordered by title like find_book.
+    The index only holds what matching and ordering need, the books of the page are loaded when it is served, so
+    stock changes are visible right away. The index lives per worker process and is kept up to date by book_changed.
+    It is built on the first search outside of the lock, searches arriving meanwhile are answered by find_book and
+    books changed meanwhile are applied once the build is done. It is rebuilt the same way every
+    SEARCH_INDEX_RECONCILE_SECONDS in the background to pick up books changed by other processes or directly in the
+    database, while the old index keeps serving.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._ready = False
+        self._pending = None
+        self._partitions = dict()
+        self._documents = dict()
+        self._reconciliation = None
+
+    def _build(self, rebuild: bool = False) -> bool:
+        """Builds the index unless another caller is building it already, returns whether it is ready."""
+        with self._lock:
+            if self._ready and not rebuild:
+                return True
+            if self._pending is not None:
+                return self._ready
+            self._pending = []
+        index = InvertedIndexSearchBackend()
+        try:
+            index.load(db.session.query(Book).filter(Book.deleted == False).yield_per(1000))
+        finally:
+            with self._lock:
+                if index._ready:
+                    self._partitions, self._documents = index._partitions, index._documents
+                    for book in self._pending:
+                        self._apply(book)
+                    self._ready = True
+                self._pending = None
+        self._start_reconciliation(current_app._get_current_object())
+        return True
+
+    def reconcile(self) -> None:
+        """Rebuilds the index from the book table and swaps it in."""
+        self._build(rebuild=True)
+
+    def _start_reconciliation(self, app) -> None:
+        interval = app.config.get('SEARCH_INDEX_RECONCILE_SECONDS', 900)
+        with self._lock:
+            if interval <= 0 or self._reconciliation is not None:
+                return
+            stopped = self._reconciliation = Event()
+
+        def run():
+            while not stopped.wait(interval):
+                with app.app_context():
+                    try:
+                        self.reconcile()
+                    except Exception as e:
+                        app.logger.exception(e)
+                    finally:
+                        db.session.remove()
+
+        Thread(target=run, name='search-index-reconciliation', daemon=True).start()
+
+    def warm_up(self) -> None:
+        self._build()
+
+    def load(self, books) -> None:
+        for book in books:
+            self._add(book, keep_sorted=False)
+        for partition in self._partitions.values():
+            partition.sort()
+        self._ready = True
+
+    def _add(self, book: Book, keep_sorted: bool = True) -> None:
+        tokens = {column: set(tokenize(getattr(book, column))) for column in column_attributes.values()}
+        partition = self._partitions.setdefault(book.resource_type, _Partition())
+        partition.add(book.isbn, tokens, keep_sorted)
+        sort_key = ((book.title or '').casefold(), book.isbn)
+        self._documents[book.isbn] = (book.resource_type, tokens, sort_key)
+
+    def _remove(self, isbn: str) -> None:
+        document = self._documents.pop(isbn, None)
+        if document is not None:
+            resource_type, tokens, _ = document
+            self._partitions[resource_type].remove(isbn, tokens)
+
+    def _apply(self, book: Book) -> None:
+        self._remove(book.isbn)
+        if not book.deleted:
+            self._add(book)
+
+    def _apply_many(self, books: list[Book]) -> None:
+        """Applies a batch of changes with one sort of every touched partition instead of an insort per token."""
+        books = {book.isbn: book for book in books}
+        for isbn in books:
+            self._remove(isbn)
+        for book in books.values():
+            if not book.deleted:
+                self._add(book, keep_sorted=False)
+        for resource_type in {book.resource_type for book in books.values() if not book.deleted}:
+            self._partitions[resource_type].sort()
+
+    def rank(self, req) -> list[str]:
+        """Isbns of the page of the request."""
+        phrase_tokens = tokenize(req.phrase)
+        if len(phrase_tokens) == 0:
+            return []
+        columns = [column_attributes[column] for column in req.columns]
+        with self._lock:
+            partitions = self._partitions.values() if req.group == 'EVERYTHING' \
+                else [self._partitions[req.group]] if req.group in self._partitions else []
+            matches = set()
+            for partition in partitions:
+                for column in columns:
+                    matches |= partition.match(column, phrase_tokens)
+            documents = [(self._documents[isbn][2], isbn) for isbn in matches]
+        return [isbn for _, isbn in nsmallest(req.offset + req.limit, documents)[req.offset:]]
+
+    def search(self, req) -> list[dict]:
+        if not self._ready and not self._build():
+            return ProcedureSearchBackend().search(req)
+        isbns = self.rank(req)
+        if len(isbns) == 0:
+            return []
+        books = {book.isbn: book for book in db.session.query(Book).filter(Book.isbn.in_(isbns), Book.deleted == False)}
+        return [books[isbn].get_relaxed_view() for isbn in isbns if isbn in books]
+
+    def book_changed(self, book: Book) -> None:
+        with self._lock:
+            if self._ready:
+                self._apply(book)
+            if self._pending is not None:
+                # a transient copy, the instance may be expired and detached by the time the build is done
+                self._pending.append(Book(**{column.key: getattr(book, column.key) for column in Book.__table__.c}))
+
+    def books_changed(self, books: list[Book]) -> None:
+        with self._lock:
+            if self._ready:
+                self._apply_many(books)
+            if self._pending is not None:
+                self._pending += [Book(**{column.key: getattr(book, column.key) for column in Book.__table__.c})
+                                  for book in books]
+
+
+backends = {
+    'procedure': ProcedureSearchBackend,
+    'index': InvertedIndexSearchBackend,
+}
+
+
+class CatalogSearch:
+    """
+    Flask extension holding the catalog search backend configured for the application, the fuzzy index serving
+    requests in FUZZY mode and the cache of serialized result pages, holding SEARCH_CACHE_SIZE pages for
+    SEARCH_CACHE_TTL seconds, disabled with a size of 0. The indexes are rebuilt every SEARCH_INDEX_RECONCILE_SECONDS,
+    disabled with 0.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        backend = app.config.get('SEARCH_BACKEND', 'procedure')
+        if backend not in backends:
+            raise ValueError(f"Unknown search backend '{backend}', expected one of {list(backends)}")
+        app.extensions['catalog_search'] = backends[backend]()
+        app.extensions['catalog_fuzzy_search'] = FuzzySearch(threshold=app.config.get('SEARCH_FUZZY_THRESHOLD', 0.5),
+                                                             budget_ms=app.config.get('SEARCH_FUZZY_BUDGET_MS', 50))
+        size = app.config.get('SEARCH_CACHE_SIZE', 1000)
+        app.extensions['search_cache'] = None
+        if size > 0:
+            app.extensions['search_cache'] = SearchResultCache(max_size=size,
+                                                               ttl=app.config.get('SEARCH_CACHE_TTL', 300))
+
+    @property
+    def backend(self) -> SearchBackend:
+        return current_app.extensions['catalog_search']
+
+    @property
+    def fuzzy(self) -> FuzzySearch:
+        return current_app.extensions['catalog_fuzzy_search']
+
+    @property
+    def cache(self) -> SearchResultCache:
+        return current_app.extensions['search_cache']
+
+    def warm_up(self) -> None:
+        """Builds the search indexes up front instead of on the first search."""
+        self.backend.warm_up()
+        self.fuzzy.warm_up()
+
+    def search(self, req) -> list[dict]:
+        if req.mode == 'FUZZY':
+            result = self.fuzzy.search(req)
+            if result is not None:
+                return result
+            # the fuzzy index is being built by another request
+        return self.backend.search(req)
+
+    def search_page(self, req) -> EncodedData:
+        """Serialized result page of the request, from the cache when it holds one."""
+        cache = self.cache
+        if cache is None:
+            return EncodedData(json.dumps(self.search(req)))
+        key = cache.get_key(req)
+        page = cache.get(key)
+        if page is None:
+            generation = cache.get_generation(req.group)
+            page = EncodedData(json.dumps(self.search(req)))
+            cache.put_page(key, page, generation)
+        return page
+
+    def book_changed(self, book: Book, previous_resource_type: str = None) -> None:
+        self.backend.book_changed(book)
+        self.fuzzy.book_changed(book)
+        if self.cache is not None:
+            self.cache.invalidate({book.resource_type, previous_resource_type} - {None})
+
+    def stock_changed(self, resource_types: set) -> None:
+        """
+        Drops the cached pages showing the available copies of books of the resource types, which loans change
+        without a book_changed. The indexes hold no stock, pages of other worker processes expire after their TTL.
+        """
+        if self.cache is not None and len(resource_types) > 0:
+            self.cache.invalidate(resource_types)
+
+    def books_changed(self, changes: list[tuple]) -> None:
+        """Applies a batch of (book, previous resource_type) changes with one invalidation of the cache."""
+        books = [book for book, _ in changes]
+        self.backend.books_changed(books)
+        self.fuzzy.books_changed(books)
+        if self.cache is not None and len(changes) > 0:
+            resource_types = {book.resource_type for book in books} | {previous for _, previous in changes}
+            self.cache.invalidate(resource_types - {None})
+
+
+catalog_search = CatalogSearch()
@@ -0,0 +1,219 @@
+from array import array
+from collections import Counter
+from heapq import nsmallest
+from threading import Event, Lock, Thread
+from time import perf_counter
+from flask import current_app
+from server import db
+from server.models import Book
+from server.search.text import tokenize
+
+fuzzy_columns = {
+    'TITLE': 'title',
+    'AUTHOR': 'author',
+}
+
+
+def trigrams(value: str) -> set[str]:
+    result = set()
+    for token in tokenize(value):
+        padded = f"  {token} "
+        for position in range(len(padded) - 2):
+            result.add(padded[position:position + 3])
+    return result
+
+
+class TrigramIndex:
+    """Posting lists of document ids per trigram of a single text field."""
+
+    chunk_size = 4096
+
+    def __init__(self):
+        self.postings = dict()
+        self.sizes = array('H')
+        self.texts = []
+
+    def add(self, doc_id: int, value: str) -> None:
+        document = trigrams(value)
+        self.texts.append(value)
+        self.sizes.append(min(len(document), 65535))
+        for trigram in document:
+            postings = self.postings.get(trigram)
+            if postings is None:
+                postings = self.postings[trigram] = array('L')
+            postings.append(doc_id)
+
+    def hits(self, query: set[str], deadline: float) -> Counter:
+        """
+        Counts the query trigrams shared by every document, shortest posting lists first and chunk_size ids at a time.
+        Once the deadline passes the remaining ids are skipped and the counts are a lower bound.
+        """
+        result = Counter()
+        for postings in sorted((self.postings.get(trigram, ()) for trigram in query), key=len):
+            for start in range(0, len(postings), self.chunk_size):
+                if perf_counter() > deadline:
+                    return result
+                result.update(postings[start:start + self.chunk_size])
+        return result
+
+
+class FuzzySearch:
+    """
+    Typo tolerant search over title and author of all active books, driven by SearchRequest.mode == 'FUZZY'.
+    Matches are ranked by the share of query trigrams found in a column, ties by trigram similarity and title.
+    Candidate scanning and verification stop once budget_ms is spent, so very broad queries return the best
+    matches found so far instead of blowing the latency of the endpoint, ranking only keeps the page and the ones
+    before it. The budget starts once the index is built, which happens on the first search outside of the lock, searches arriving meanwhile get None and books
+    changed meanwhile are applied once the build is done.
+    """
+
+    def __init__(self, threshold: float = 0.5, budget_ms: float = 50):
+        self.threshold = threshold
+        self.budget_ms = budget_ms
+        self._lock = Lock()
+        self._ready = False
+        self._pending = None
+        self._reconciliation = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._fields = {column: TrigramIndex() for column in fuzzy_columns.values()}
+        self._isbns = []
+        self._types = []
+        self._titles = []
+        self._ids = dict()
+
+    def _build(self, rebuild: bool = False) -> bool:
+        """Builds the index unless another caller is building it already, returns whether it is ready."""
+        with self._lock:
+            if self._ready and not rebuild:
+                return True
+            if self._pending is not None:
+                return self._ready
+            self._pending = []
+        index = FuzzySearch(self.threshold, self.budget_ms)
+        try:
+            index.load(db.session.query(Book).filter(Book.deleted == False).yield_per(1000))
+        finally:
+            with self._lock:
+                if index._ready:
+                    self._fields, self._isbns, self._types, self._titles, self._ids = \
+                        index._fields, index._isbns, index._types, index._titles, index._ids
+                    for document in self._pending:
+                        self._apply(*document)
+                    self._ready = True
+                self._pending = None
+        self._start_reconciliation(current_app._get_current_object())
+        return True
+
+    def reconcile(self) -> None:
+        """Rebuilds the index from the book table and swaps it in."""
+        self._build(rebuild=True)
+
+    def _start_reconciliation(self, app) -> None:
+        interval = app.config.get('SEARCH_INDEX_RECONCILE_SECONDS', 900)
+        with self._lock:
+            if interval <= 0 or self._reconciliation is not None:
+                return
+            stopped = self._reconciliation = Event()
+
+        def run():
+            while not stopped.wait(interval):
+                with app.app_context():
+                    try:
+                        self.reconcile()
+                    except Exception as e:
+                        app.logger.exception(e)
+                    finally:
+                        db.session.remove()
+
+        Thread(target=run, name='fuzzy-index-reconciliation', daemon=True).start()
+
+    def warm_up(self) -> None:
+        self._build()
+
+    def load(self, books) -> None:
+        for book in books:
+            self._add(book.isbn, book.title, book.author, book.resource_type)
+        self._ready = True
+
+    def _add(self, isbn: str, title: str, author: str, resource_type: str) -> None:
+        doc_id = len(self._isbns)
+        self._isbns.append(isbn)
+        self._types.append(resource_type)
+        self._titles.append((title or '').casefold())
+        self._fields['title'].add(doc_id, title or '')
+        self._fields['author'].add(doc_id, author or '')
+        self._ids[isbn] = doc_id
+
+    def _remove(self, isbn: str) -> None:
+        doc_id = self._ids.pop(isbn, None)
+        if doc_id is not None:
+            self._isbns[doc_id] = None
+        if len(self._ids) * 2 < len(self._isbns):
+            self._compact()
+
+    def _compact(self) -> None:
+        live = [(self._isbns[doc_id], self._fields['title'].texts[doc_id], self._fields['author'].texts[doc_id],
+                 self._types[doc_id]) for doc_id in sorted(self._ids.values())]
+        self._reset()
+        for document in live:
+            self._add(*document)
+
+    def _apply(self, isbn: str, title: str, author: str, resource_type: str, deleted: bool) -> None:
+        self._remove(isbn)
+        if not deleted:
+            self._add(isbn, title, author, resource_type)
+
+    def rank(self, phrase: str, columns: list[str], group: str, offset: int, limit: int) -> list[str]:
+        """Isbns of the page, None while another caller builds the index."""
+        query = trigrams(phrase)
+        fields = [fuzzy_columns[column] for column in columns if column in fuzzy_columns]
+        if len(query) == 0 or len(fields) == 0:
+            return []
+        if not self._ready and not self._build():
+            return None
+        # counting gets the first half of the budget, so the candidates found are scored within the second one
+        started = perf_counter()
+        counting_deadline, deadline = started + self.budget_ms / 2000, started + self.budget_ms / 1000
+        with self._lock:
+            scores = dict()
+            for field in fields:
+                index = self._fields[field]
+                for doc_id, hits in index.hits(query, counting_deadline).items():
+                    if perf_counter() > deadline:
+                        break
+                    score = (hits / len(query), hits / (len(query) + index.sizes[doc_id] - hits))
+                    if score[0] < self.threshold or score <= scores.get(doc_id, (0, 0)) \
+                            or self._isbns[doc_id] is None \
+                            or (group != 'EVERYTHING' and self._types[doc_id] != group):
+                        continue
+                    scores[doc_id] = score
+            ranked = nsmallest(offset + limit, scores,
+                               key=lambda doc_id: (-scores[doc_id][0], -scores[doc_id][1], self._titles[doc_id]))
+            return [self._isbns[doc_id] for doc_id in ranked[offset:]]
+
+    def search(self, req) -> list[dict]:
+        """Relaxed views of the page, None while another caller builds the index."""
+        isbns = self.rank(req.phrase, req.columns, req.group, req.offset, req.limit)
+        if isbns is None or len(isbns) == 0:
+            return isbns
+        books = {book.isbn: book for book in db.session.query(Book).filter(Book.isbn.in_(isbns))}
+        return [books[isbn].get_relaxed_view() for isbn in isbns if isbn in books]
+
+    def book_changed(self, book: Book) -> None:
+        document = (book.isbn, book.title, book.author, book.resource_type, book.deleted)
+        with self._lock:
+            if self._ready:
+                self._apply(*document)
+            if self._pending is not None:
+                self._pending.append(document)
+
+    def books_changed(self, books: list[Book]) -> None:
+        documents = [(book.isbn, book.title, book.author, book.resource_type, book.deleted) for book in books]
+        with self._lock:
+            if self._ready:
+                for document in documents:
+                    self._apply(*document)
+            if self._pending is not None:
+                self._pending += documents
@@ -0,0 +1,7 @@
+import re
+
+token_pattern = re.compile(r"\w+")
+
+
+def tokenize(value: str) -> list[str]:
+    return token_pattern.findall(value.casefold()) if value else []
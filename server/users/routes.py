@@ -1,8 +1,15 @@
 from flask import request, session, Blueprint, Response
 from flask_login import login_user, current_user, logout_user, login_required
-from server.config import CustomResponse, RecordAlreadyExistsException, RecordNotFoundException
-from server import db, bcrypt, Config
+from sqlalchemy.orm import joinedload
+from sqlalchemy.exc import IntegrityError
+from server.config import CustomResponse, RecordAlreadyExistsException, RecordNotFoundException, \
+    ServiceOverloadedException, requested_stream_format
+from server import db, Config
+from server.passwords import password_pool
 from server.models import Customer, Loan, CustomerWishlistItem
+from server.loaders import customer_relaxed_view
+from server.serializers import loan_relaxed_view
+from server.replicas import read_only
 
 users = Blueprint('users', __name__, url_prefix='/api/user')
 users_unsecure = Blueprint('users_unsecure', __name__, url_prefix='/user')
@@ -25,13 +32,17 @@ def login() -> Response:
     if current_user.is_authenticated:
         res.set_data(current_user.get_relaxed_view())
         return res.get_response()
-    user = db.session.query(Customer).filter(Customer.email == request.json.get('email')).first()
-    if user and bcrypt.check_password_hash(user.password, request.json.get('password')):
-        login_user(user)
-        session['login_type'] = 'customer'
-        res.set_data(user.get_relaxed_view())
-    else:
-        res.set_error('Wrong email or password!')
+    user = customer_relaxed_view.first(Customer.email == request.json.get('email'))
+    try:
+        if user and password_pool.check_password_hash(user.password, request.json.get('password')):
+            login_user(user)
+            session['login_type'] = 'customer'
+            res.set_data(user.get_relaxed_view())
+        else:
+            res.set_error('Wrong email or password!')
+    except ServiceOverloadedException as e:
+        res.set_error(e.message)
+        return res.get_response(503)
     return res.get_response()
 
 
@@ -44,17 +55,33 @@ def logout() -> Response:
 
 
 @users.route('/history')
+@read_only
 @login_required
 def fetch_history() -> Response:
     res = CustomResponse()
     if current_user is None or current_user.ssn is None:
         logout_user()
         return res.get_response()
-    loans = db.session.query(Loan).filter(Loan.customer_ssn == current_user.ssn).order_by(Loan.loaned_at.desc()).all()
-    res.set_data(list(map(lambda loan: loan.get_relaxed_view(), loans)))
+    loans = db.session.query(Loan).options(joinedload(Loan.book)) \
+        .filter(Loan.customer_ssn == current_user.ssn).order_by(Loan.loaned_at.desc())
+    stream_format = requested_stream_format()
+    if stream_format is not None:
+        return res.get_streamed_response(loans.yield_per(500), loan_relaxed_view, stream_format)
+    res.set_data(loan_relaxed_view.encode_many(loans.all()))
     return res.get_response()
 
 
+def wishlist_items():
+    return db.session.query(CustomerWishlistItem).options(joinedload(CustomerWishlistItem.book)) \
+        .filter(CustomerWishlistItem.customer_ssn == current_user.ssn)
+
+
+def is_in_wishlist(isbn: str) -> bool:
+    return db.session.query(CustomerWishlistItem.id) \
+        .filter(CustomerWishlistItem.customer_ssn == current_user.ssn, CustomerWishlistItem.book_isbn == isbn) \
+        .first() is not None
+
+
 @users.route('/wishlist')
 @login_required
 def fetch_wishlist() -> Response:
@@ -63,7 +90,7 @@ def fetch_wishlist() -> Response:
         logout_user()
         return res.get_response()
     try:
-        res.set_data(list(map(lambda item: item.get_relaxed_view(), current_user.wishlist_items)))
+        res.set_data(list(map(lambda item: item.get_relaxed_view(), wishlist_items())))
     except:
         db.session.rollback()
         res.set_error(Config.UNHANDLED_EXCEPTION_MESSAGE)
@@ -78,11 +105,20 @@ def add_to_wishlist(isbn: str) -> Response:
         logout_user()
         return res.get_response()
     try:
-        if isbn in list(map(lambda item: item.book_isbn, current_user.wishlist_items)):
+        # checked up front as well, the unique constraint only exists where the DDL from the README was applied
+        if is_in_wishlist(isbn):
             raise RecordAlreadyExistsException(isbn)
-        current_user.wishlist_items.append(CustomerWishlistItem(book_isbn=isbn, customer_ssn=current_user.ssn))
+        item = CustomerWishlistItem(book_isbn=isbn, customer_ssn=current_user.ssn)
+        db.session.add(item)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            if is_in_wishlist(isbn):
+                raise RecordAlreadyExistsException(isbn)
+            raise
+        res.set_data(item.get_relaxed_view())
         db.session.commit()
-        res.set_data(list(map(lambda item: item.get_relaxed_view(), current_user.wishlist_items)))
     except RecordAlreadyExistsException as e:
         db.session.rollback()
         res.set_error(e.message)
@@ -100,11 +136,13 @@ def remove_from_wishlist(isbn: str) -> Response:
         logout_user()
         return res.get_response()
     try:
-        if isbn not in list(map(lambda item: item.book_isbn, current_user.wishlist_items)):
+        deleted = db.session.query(CustomerWishlistItem) \
+            .filter(CustomerWishlistItem.customer_ssn == current_user.ssn, CustomerWishlistItem.book_isbn == isbn) \
+            .delete(synchronize_session=False)
+        if deleted == 0:
             raise RecordNotFoundException(isbn)
-        db.session.delete(list(filter(lambda item: item.book_isbn == isbn, current_user.wishlist_items))[0])
         db.session.commit()
-        res.set_data(list(map(lambda item: item.get_relaxed_view(), current_user.wishlist_items)))
+        res.set_data({'isbn': isbn})
     except RecordNotFoundException as e:
         db.session.rollback()
         res.set_error(e.message)
@@ -122,12 +160,12 @@ def request_from_wishlist(id: str) -> Response:
         logout_user()
         return res.get_response()
     try:
-        if id not in list(map(lambda item: item.id, current_user.wishlist_items)):
+        wishlist_item = wishlist_items().filter(CustomerWishlistItem.id == id).first()
+        if wishlist_item is None:
             raise RecordNotFoundException(id)
-        wishlist_item = list(filter(lambda item: item.id == id, current_user.wishlist_items))[0]
         wishlist_item.request_now()
+        res.set_data(wishlist_item.get_relaxed_view())
         db.session.commit()
-        res.set_data(list(map(lambda item: item.get_relaxed_view(), current_user.wishlist_items)))
     except RecordNotFoundException as e:
         db.session.rollback()
         res.set_error(e.message)
@@ -0,0 +1,159 @@
+from datetime import datetime
+from threading import Event, Lock, Thread
+from flask import current_app
+from server import db
+from server.models import Book, Customer, Loan
+
+breakdowns = ['type', 'subject_area']
+
+
+def loan_days(loaned_at: datetime, returned_at: datetime) -> int:
+    """Whole days between the two dates, same as DATEDIFF(day, loaned_at, returned_at)."""
+    return (returned_at.date() - loaned_at.date()).days
+
+
+class RunningAverage:
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, value: int) -> None:
+        self.total += value
+        self.count += 1
+
+    def get_average(self) -> float:
+        return round(self.total / self.count, 2) if self.count > 0 else None
+
+
+class LoanDurationAggregate:
+    """Sum and count of closed loan durations, overall and per customer type and subject area."""
+
+    def __init__(self):
+        self.overall = RunningAverage()
+        self.by = {breakdown: dict() for breakdown in breakdowns}
+
+    def add(self, days: int, type: str, subject_area: str) -> None:
+        self.overall.add(days)
+        for breakdown, key in zip(breakdowns, [type, subject_area]):
+            self.by[breakdown].setdefault(key, RunningAverage()).add(days)
+
+    def get_view(self, breakdown: str = None) -> list[dict]:
+        if breakdown is None:
+            return [{'days': self.overall.get_average()}]
+        return [{breakdown: key, 'days': average.get_average()} for key, average in sorted(self.by[breakdown].items())]
+
+
+class LoanDurations:
+    """
+    Flask extension serving the average loan duration from a running aggregate instead of recomputing it
+    over every closed loan. The aggregate is backfilled from the loan table on first use, updated by closed loans and
+    backfilled again every LOAN_DURATIONS_RECONCILE_SECONDS in the background, so loans closed by other processes
+    or directly in the database do not make the workers drift apart. Loans closed during a backfill are added to the
+    new aggregate before it replaces the old one.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.extensions['loan_durations'] = {
+            'lock': Lock(),
+            'build_lock': Lock(),
+            'aggregate': None,
+            'pending': None,
+            'reconciliation': None,
+        }
+
+    @property
+    def _state(self) -> dict:
+        return current_app.extensions['loan_durations']
+
+    def backfill(self) -> LoanDurationAggregate:
+        aggregate = LoanDurationAggregate()
+        closed_loans = db.session.query(Loan.loaned_at, Loan.returned_at, Customer.type, Book.subject_area) \
+            .join(Customer, Customer.ssn == Loan.customer_ssn) \
+            .join(Book, Book.isbn == Loan.book_isbn) \
+            .filter(Loan.returned_at != None) \
+            .yield_per(10000)
+        for loaned_at, returned_at, type, subject_area in closed_loans:
+            aggregate.add(loan_days(loaned_at, returned_at), type, subject_area)
+        return aggregate
+
+    def reconcile(self) -> None:
+        with self._state['build_lock']:
+            self._rebuild()
+
+    def _rebuild(self) -> LoanDurationAggregate:
+        """Backfills and swaps in a new aggregate, the caller holds the build lock."""
+        state = self._state
+        with state['lock']:
+            state['pending'] = []
+        aggregate = None
+        try:
+            aggregate = self.backfill()
+        finally:
+            with state['lock']:
+                if aggregate is not None:
+                    for closed_loan in state['pending']:
+                        aggregate.add(*closed_loan)
+                    state['aggregate'] = aggregate
+                state['pending'] = None
+        return aggregate
+
+    def _aggregate(self) -> LoanDurationAggregate:
+        state = self._state
+        if state['aggregate'] is None:
+            with state['build_lock']:
+                if state['aggregate'] is None:
+                    self._rebuild()
+                    self._start_reconciliation(current_app._get_current_object())
+        return state['aggregate']
+
+    def _start_reconciliation(self, app) -> None:
+        interval = app.config.get('LOAN_DURATIONS_RECONCILE_SECONDS', 900)
+        if interval <= 0 or app.extensions['loan_durations']['reconciliation'] is not None:
+            return
+        stopped = Event()
+
+        def run():
+            while not stopped.wait(interval):
+                with app.app_context():
+                    try:
+                        self.reconcile()
+                    except Exception as e:
+                        app.logger.exception(e)
+                    finally:
+                        db.session.remove()
+
+        app.extensions['loan_durations']['reconciliation'] = stopped
+        Thread(target=run, name='loan-durations-reconciliation', daemon=True).start()
+
+    def warm_up(self) -> None:
+        """Backfills the aggregate up front instead of on first use."""
+        self._aggregate()
+
+    def get_overall(self) -> tuple[int, float]:
+        """Number of closed loans and their average duration in the aggregate served."""
+        self._aggregate()
+        with self._state['lock']:
+            overall = self._state['aggregate'].overall
+            return overall.count, overall.get_average()
+
+    def get_view(self, breakdown: str = None) -> list[dict]:
+        self._aggregate()
+        with self._state['lock']:
+            return self._state['aggregate'].get_view(breakdown)
+
+    def loans_closed(self, closed_loans: list[tuple]) -> None:
+        """Adds the (days, customer type, subject area) of closed loans, read before their commit expired them."""
+        state = self._state
+        with state['lock']:
+            if state['aggregate'] is not None:
+                for closed_loan in closed_loans:
+                    state['aggregate'].add(*closed_loan)
+            if state['pending'] is not None:
+                state['pending'] += closed_loans
+
+loan_durations = LoanDurations()
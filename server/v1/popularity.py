@@ -0,0 +1,157 @@
+from heapq import heapify, heappush, heapreplace, nlargest
+from threading import Event, Lock, Thread
+from flask import current_app
+from sqlalchemy import func
+from server import db
+from server.models import Book, Loan
+
+
+class Leaderboard:
+    """
+    Loan counts of every book plus a min-heap of the `size` most loaned ones.
+    A loan of a book outside the heap replaces the heap minimum once its count gets higher.
+    """
+
+    def __init__(self, counts: dict, books: dict, size: int):
+        self.size = size
+        self.counts = counts
+        self.books = books
+        self.heap = [[count, isbn] for isbn, count in nlargest(size, counts.items(), key=lambda item: item[1])]
+        heapify(self.heap)
+        self.entries = {entry[1]: entry for entry in self.heap}
+        self.ranking = None
+
+    def increment(self, book: Book) -> None:
+        count = self.counts[book.isbn] = self.counts.get(book.isbn, 0) + 1
+        entry = self.entries.get(book.isbn)
+        if entry is not None:
+            entry[0] = count
+            heapify(self.heap)
+        elif len(self.heap) < self.size:
+            self._enter([count, book.isbn], book)
+            heappush(self.heap, self.entries[book.isbn])
+        elif count > self.heap[0][0]:
+            del self.entries[self.heap[0][1]]
+            self._enter([count, book.isbn], book)
+            heapreplace(self.heap, self.entries[book.isbn])
+        else:
+            return
+        self.ranking = None
+
+    def _enter(self, entry: list, book: Book) -> None:
+        self.entries[book.isbn] = entry
+        self.books[book.isbn] = {'isbn': book.isbn, 'title': book.title, 'author': book.author}
+
+    def top(self, count: int) -> list[dict]:
+        if self.ranking is None:
+            self.ranking = [{**self.books[isbn], 'loan_count': loans}
+                            for loans, isbn in sorted(self.heap, key=lambda entry: (-entry[0], entry[1]))]
+        return self.ranking[:count]
+
+
+class PopularBooks:
+    """
+    Flask extension serving the most loaned books from memory. The leaderboard is built from the loan table on
+    first use, updated by every started loan and rebuilt every POPULAR_BOOKS_RECONCILE_SECONDS in the background
+    to pick up loans made by other processes or directly in the database.
+    One build runs at a time and without the lock readers take. Loans started during a build are applied to the
+    new leaderboard before it replaces the old one, a loan committed just before the build queried the table may
+    be counted twice until the next rebuild but none is lost.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.extensions['popular_books'] = {
+            'lock': Lock(),
+            'build_lock': Lock(),
+            'leaderboard': None,
+            'pending': None,
+            'reconciliation': None,
+        }
+
+    @property
+    def _state(self) -> dict:
+        return current_app.extensions['popular_books']
+
+    @property
+    def limit(self) -> int:
+        return current_app.config.get('POPULAR_BOOKS_LIMIT', 100)
+
+    def build(self) -> Leaderboard:
+        counts = dict(db.session.query(Loan.book_isbn, func.count(Loan.id)).group_by(Loan.book_isbn).all())
+        top = [isbn for isbn, _ in nlargest(self.limit, counts.items(), key=lambda item: item[1])]
+        books = {book.isbn: {'isbn': book.isbn, 'title': book.title, 'author': book.author}
+                 for book in db.session.query(Book).filter(Book.isbn.in_(top))} if len(top) > 0 else dict()
+        return Leaderboard(counts, books, self.limit)
+
+    def reconcile(self) -> None:
+        with self._state['build_lock']:
+            self._rebuild()
+
+    def _rebuild(self) -> Leaderboard:
+        """Builds and swaps in a new leaderboard, the caller holds the build lock."""
+        state = self._state
+        with state['lock']:
+            state['pending'] = []
+        leaderboard = None
+        try:
+            leaderboard = self.build()
+        finally:
+            with state['lock']:
+                if leaderboard is not None:
+                    for book in state['pending']:
+                        leaderboard.increment(book)
+                    state['leaderboard'] = leaderboard
+                state['pending'] = None
+        return leaderboard
+
+    def _leaderboard(self) -> Leaderboard:
+        state = self._state
+        if state['leaderboard'] is None:
+            with state['build_lock']:
+                if state['leaderboard'] is None:
+                    self._rebuild()
+                    self._start_reconciliation(current_app._get_current_object())
+        return state['leaderboard']
+
+    def _start_reconciliation(self, app) -> None:
+        interval = app.config.get('POPULAR_BOOKS_RECONCILE_SECONDS', 900)
+        if interval <= 0 or app.extensions['popular_books']['reconciliation'] is not None:
+            return
+        stopped = Event()
+
+        def run():
+            while not stopped.wait(interval):
+                with app.app_context():
+                    try:
+                        self.reconcile()
+                    except Exception as e:
+                        app.logger.exception(e)
+                    finally:
+                        db.session.remove()
+
+        app.extensions['popular_books']['reconciliation'] = stopped
+        Thread(target=run, name='popular-books-reconciliation', daemon=True).start()
+
+    def warm_up(self) -> None:
+        """Builds the leaderboard up front instead of on first use."""
+        self._leaderboard()
+
+    def top(self, count: int) -> list[dict]:
+        self._leaderboard()
+        with self._state['lock']:
+            return self._state['leaderboard'].top(count)
+
+    def loan_started(self, book: Book) -> None:
+        state = self._state
+        with state['lock']:
+            if state['leaderboard'] is not None:
+                state['leaderboard'].increment(book)
+            if state['pending'] is not None:
+                state['pending'].append(Book(**{column.key: getattr(book, column.key) for column in Book.__table__.c}))
+
+
+popular_books = PopularBooks()
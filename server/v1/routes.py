@@ -1,12 +1,19 @@
 from datetime import datetime, timedelta
 
-from flask import Blueprint, request
+from flask import Blueprint, current_app, request
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql import text
 
-from server import bcrypt, db, Config
-from server.config import CustomResponse, InvalidRequestException
+from server import db, Config
+from server.config import CustomResponse, InvalidRequestException, ServiceOverloadedException
+from server.passwords import password_pool
 from server.models import Customer, Card, Address, PhoneNumber
+from server.cache.typeahead import typeahead
+from server.loaders import customer_relaxed_v1_view
+from server.v1.popularity import popular_books
+from server.v1.loan_duration import loan_durations, breakdowns
+from server import procedures
+from server.replicas import read_only
 
 public_api = Blueprint('v1', __name__, url_prefix='/v1')
 
@@ -16,7 +23,7 @@ def register_professor():
     res = CustomResponse()
     try:
         password = Customer.generate_password()
-        pw_hash = bcrypt.generate_password_hash(password=password)
+        pw_hash = password_pool.generate_password_hash(password)
         phone_numbers = request.json.get('phone_numbers')
         phone_numbers = list(
             map(lambda number: PhoneNumber(customer_ssn=request.json.get('ssn'), **number), phone_numbers))
@@ -32,8 +39,9 @@ def register_professor():
         customer = Customer(**request.json, cards=cards, address=address, phone_numbers=phone_numbers, pw_hash=pw_hash)
         db.session.add(customer)
         db.session.commit()
+        typeahead.customer_changed(customer)
 
-        result = customer.get_relaxed_v1_view()
+        result = customer_relaxed_v1_view.get(customer.ssn).get_relaxed_v1_view()
         result['password'] = password
         res.set_data(result)
         return res.get_response(201)
@@ -43,6 +51,10 @@ def register_professor():
     except IntegrityError as e:
         db.session.rollback()
         res.set_error(Config.UNHANDLED_EXCEPTION_MESSAGE)
+    except ServiceOverloadedException as e:
+        db.session.rollback()
+        res.set_error(e.message)
+        return res.get_response(503)
     except:
         db.session.rollback()
         res.set_error(Config.UNHANDLED_EXCEPTION_MESSAGE)
@@ -50,32 +62,49 @@ def register_professor():
 
 
 @public_api.route('/statistics/books/popular/<int:count>')
+@read_only
 def fetch_top_x_popular_books(count: int):
     res = CustomResponse()
     try:
-        with db.engine.connect() as con:
-            statement = text(f"""exec fetch_top_x_popular_books @limit = :count;""")
-            rs = con.execute(statement, {'count': count})
-            data = []
-            for row in rs:
-                data.append(dict(row))
-            res.set_data(data)
+        if count < 1 or count > popular_books.limit:
+            raise InvalidRequestException(f"Count must be between 1 and {popular_books.limit}!")
+        res.set_data(popular_books.top(count))
+    except InvalidRequestException as e:
+        res.set_error(e.message)
     except Exception as e:
         print(str(e))
         res.set_error(Config.UNHANDLED_EXCEPTION_MESSAGE)
     return res.get_response()
 
 
+@public_api.cli.command('reconcile-popular-books')
+def reconcile_popular_books():
+    """Rebuilds the popular books leaderboard from the loan table."""
+    popular_books.reconcile()
+    current_app.logger.info(f"popular books reconciled: {popular_books.top(popular_books.limit)}")
+
+
 @public_api.route('/statistics/loans/averageTimeInDays')
+@read_only
 def get_average_loan_time_in_days():
     res = CustomResponse()
     try:
-        with db.engine.connect() as con:
-            rs = con.execute("exec get_average_loan_time_in_days;")
-            data = []
-            for row in rs:
-                data.append({'days': row['average_loan_length_in_days']})
-            res.set_data(data)
+        breakdown = request.args.get('by')
+        if breakdown is not None and breakdown not in breakdowns:
+            raise InvalidRequestException(f"Breakdown must be one of {', '.join(breakdowns)}!")
+        res.set_data(loan_durations.get_view(breakdown))
+    except InvalidRequestException as e:
+        res.set_error(e.message)
     except:
         res.set_error(Config.UNHANDLED_EXCEPTION_MESSAGE)
     return res.get_response()
+
+
+@public_api.cli.command('check-loan-durations')
+def check_loan_durations():
+    """Compares the average loan duration served from the running aggregate with get_average_loan_time_in_days."""
+    count, average = loan_durations.get_overall()
+    expected = procedures.get_average_loan_time_in_days(db.session.connection())
+    print(f"closed loans: {count}, running aggregate: {average}, database: {expected}")
+    if (average is None) != (expected is None) or (average is not None and abs(average - float(expected)) > 0.01):
+        raise SystemExit(1)